@@ -29,13 +29,20 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from common import WorldState, Condition
+from common import WorldState, Condition, ConditionPoller
 from common import Precondition, Effect, VariableEffect
 from common import Goal, Action
 
 from memory import Memory, MemoryCondition
 
+from heuristics import Heuristic, ZeroHeuristic, RelativeDistanceHeuristic
+from heuristics import HMaxHeuristic, HAddHeuristic, RelaxedPlanHeuristic
+
 from planning import Node, Planner, PlanExecutor
+from planning import PlanningBudget, CancellationToken, PLAN_FOUND, NO_PLAN, BUDGET_EXHAUSTED
+
+from plancache import PlanCache, PlanStore
+from parallel import CompiledDomain, plan_goals_in_parallel, PlannerPortfolio
 
 from runner import Runner
 
@@ -29,6 +29,9 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+from multiprocessing.pool import ThreadPool
+from time import time
+
 import logging
 _logger = logging.getLogger('rgoap')
 
@@ -44,62 +47,209 @@ def stringify_dict(dict_, delim=', '):
 def stringify(iterable, delim=', '):
     return delim.join([str(e) for e in iterable])
 
+def check_freeform_contexts(actions, pool=None):
+    """Return the set of the given actions whose freeform context is valid,
+    see Action.is_freeform_context_valid(). With a ThreadPool the actions
+    whose results cannot be reused are checked in its threads, as the
+    checks usually wait for services or hardware."""
+    actions = list(actions)
+    valid_actions = set()
+    if pool is not None:
+        now = time()
+        unchecked_actions = [action for action in actions
+                             if not action._has_reusable_freeform_context(now)]
+        if len(unchecked_actions) > 1:
+            results = pool.map(lambda action: action.is_freeform_context_valid(),
+                               unchecked_actions)
+            valid_actions.update(action for (action, valid) in zip(unchecked_actions, results)
+                                 if valid)
+            unchecked_actions = set(unchecked_actions)
+            actions = [action for action in actions if action not in unchecked_actions]
+    valid_actions.update(action for action in actions if action.is_freeform_context_valid())
+    return valid_actions
+
+
+
+class _Unset(object):
+    """Type of the UNSET sentinel"""
+
+    def __repr__(self):
+        return 'UNSET'
+
+UNSET = _Unset()
+"""Marks conditions without a value in a worldstate's value array"""
+
 
 
 class WorldState(object):
     """Storage for values of conditions.
 
-    self._condition_values: Map<Condition, Object>
+    self._values: List<Object>, the value of each condition at the
+                  condition's index (see Condition), UNSET if not set
+    self._indices: List<int>, the indices of all set conditions
+    self._changes: List<Condition>, the conditions changed while
+                   recording (see record_changes), else None
+
+    A copy shares the value array with its original until one of both is
+    modified (copy on write), so copying is cheap even for big worldstates.
+    The hash is maintained incrementally with every modification by XORing
+    a key for each condition/value pair (Zobrist hashing).
     """
 
     def __init__(self, worldstate=None):
-        self._condition_values = {}
-        if worldstate is not None:
-            self._condition_values.update(worldstate._condition_values)
+        if worldstate is None:
+            self._values = []
+            self._indices = []
+            self._hash = 0
+            self._shared = False
+        else:
+            self._values = worldstate._values
+            self._indices = worldstate._indices
+            self._hash = worldstate._hash
+            self._shared = worldstate._shared = True
+        self._changes = None
 
     def __str__(self):
         return '%s {%s}' % (self.__class__.__name__,
-                            no_multilines(stringify_dict(self._condition_values)))
+                            no_multilines(stringify_dict(dict(self.iteritems()))))
 
     def __repr__(self):
-        return '<WorldState %X values=%s>' % (id(self), self._condition_values)
+        return '<WorldState %X values=%s>' % (id(self), dict(self.iteritems()))
 #        return '<WorldState>'
 
+    def __eq__(self, other):
+        if not isinstance(other, WorldState):
+            return False
+        if self._values is other._values:
+            return True
+        if (self._hash is not None and other._hash is not None and
+                self._hash != other._hash):
+            return False
+        if len(self._indices) != len(other._indices):
+            return False
+        values = self._values
+        other_values = other._values
+        num_other_values = len(other_values)
+        for index in self._indices:
+            if index >= num_other_values or not other_values[index] == values[index]:
+                return False # note that UNSET equals nothing but UNSET
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        """Hash over the condition values, which therefore must be hashable.
+
+        Do not modify a worldstate while it is used as a key, e.g. in the
+        planner's transposition table.
+        """
+        if self._hash is None:
+            # raises TypeError if a value is still unhashable
+            hash_ = 0
+            values = self._values
+            for index in self._indices:
+                hash_ ^= hash((index, values[index]))
+            self._hash = hash_
+        return self._hash
+
+    def __len__(self):
+        """Return the number of set conditions"""
+        return len(self._indices)
+
+    def iteritems(self):
+        """Return an iterator over (condition, value) of all set conditions"""
+        conditions = Condition._conditions_by_index
+        values = self._values
+        return ((conditions[index], values[index]) for index in self._indices)
+
     def get_condition_value(self, condition):
-        return self._condition_values[condition]
+        try:
+            value = self._values[condition._index]
+        except IndexError:
+            raise KeyError(condition)
+        if value is UNSET:
+            raise KeyError(condition)
+        return value
 
     def set_condition_value(self, condition, value):
-        self._condition_values[condition] = value
+        assert value is not UNSET, "Conditions cannot be unset"
+        index = condition._index
+        values = self._values
+        if index < len(values):
+            old_value = values[index]
+            if type(old_value) is type(value) and old_value == value:
+                return # no change, avoid copying
+        else:
+            old_value = UNSET
+
+        if self._changes is not None:
+            self._changes.append(condition)
+
+        if self._shared:
+            values = self._values = values[:]
+            self._indices = self._indices[:]
+            self._shared = False
+
+        if old_value is UNSET:
+            if index >= len(values):
+                values.extend([UNSET] * (index + 1 - len(values)))
+            self._indices.append(index)
+
+        if self._hash is not None:
+            try:
+                if old_value is not UNSET:
+                    self._hash ^= hash((index, old_value))
+                self._hash ^= hash((index, value))
+            except TypeError: # unhashable value, recalculate on demand
+                self._hash = None
+
+        values[index] = value
+
+    def record_changes(self):
+        """Start recording the conditions whose values are changed."""
+        self._changes = []
+
+    def pop_changes(self):
+        """Stop recording and return the list of changed conditions."""
+        changes = self._changes
+        self._changes = None
+        return changes
 
     def matches(self, start_worldstate):
         """Return whether self is an 'equal subset' of start_worldstate."""
-        start_ws_dict = start_worldstate._condition_values
+        values = self._values
+        start_values = start_worldstate._values
+        num_start_values = len(start_values)
         matches = True
-        for (cond, value) in self._condition_values.viewitems():
-            if cond in start_ws_dict:
-                if not start_ws_dict[cond] == value:
+        for index in self._indices:
+            if index < num_start_values:
+                start_value = start_values[index]
+                if start_value is not UNSET and not start_value == values[index]:
                     matches = False
                     break
         _logger.debug('comparing worldstates: %s', matches)
-#        _logger.debug('mine:  %s', self._condition_values)
-#        _logger.debug('start: %s', start_ws_dict)
         return matches
 
     def get_state_name_dict(self):
         """Returns a dictionary with not the conditions themselves but
         their state_names as keys."""
         return {cond._state_name: val
-                for cond, val in self._condition_values.viewitems()}
+                for cond, val in self.iteritems()}
 
     def get_unsatisfied_conditions(self, worldstate):
         """Return a set of conditions that are in both the given and this
         worldstate but have unequal values. By now this is symmetric."""
-        common_conditions_set = (self._condition_values.viewkeys() &
-                                 worldstate._condition_values.viewkeys())
-        unsatisfied_conditions = {condition
-                                  for condition in common_conditions_set
-                                  if (self.get_condition_value(condition) !=
-                                      worldstate.get_condition_value(condition))}
+        conditions = Condition._conditions_by_index
+        values = self._values
+        other_values = worldstate._values
+        num_other_values = len(other_values)
+        unsatisfied_conditions = set()
+        for index in self._indices:
+            if index < num_other_values:
+                other_value = other_values[index]
+                if other_value is not UNSET and values[index] != other_value:
+                    unsatisfied_conditions.add(conditions[index])
 
         if _logger.isEnabledFor(logging.DEBUG):
             _logger.debug("unsatisfied conditions between world states: %d:\n%s",
@@ -119,13 +269,29 @@ class Condition(object):
     * If there is no mapping for a get(state_name) call an assertion is
       triggered, as creating a new instance makes no sense here.
 
+    Every instance is interned to a dense integer index on creation, which
+    worldstates use to store the condition's value in an array.
+
     self._state_name: id name of condition, must not be changed
+    self._index: index of condition, must not be changed
+    self.last_latency: seconds the last get_value() took, see update_worldstate()
+    self.stale: whether the last get_value() timed out, leaving the last known
+        value in the worldstate
+    self.pushes_values: whether the condition calls notify_observers() on every
+        change of its value, so that it need not be polled while observed
     """
 
+    last_latency = None
+    stale = False
+    pushes_values = False
+    _observers = ()
+
     def __init__(self, state_name):
         assert state_name not in Condition._conditions_dict, \
             "Condition '" + state_name + "' had already been created previously!"
         self._state_name = state_name
+        self._index = len(Condition._conditions_by_index)
+        Condition._conditions_by_index.append(self)
 
     def __str__(self):
         return '%s:%s' % (self.__class__.__name__, self._state_name)
@@ -137,14 +303,38 @@ class Condition(object):
         """Returns the current value, hopefully not blocking."""
         raise NotImplementedError
 
+    def add_observer(self, observer):
+        """Let observer(condition) be called whenever the value changes,
+        which only conditions pushing their values do."""
+        self._observers = self._observers + (observer,)
+
+    def remove_observer(self, observer):
+        self._observers = tuple(o for o in self._observers if o is not observer)
+
+    def notify_observers(self):
+        """Tell the observers that the value changed, to be called by
+        conditions pushing their values, possibly from another thread."""
+        for observer in self._observers:
+            observer(self)
+
+    def _poll_value(self):
+        """Return the current value and the seconds it took to get it."""
+        start_time = time()
+        value = self.get_value()
+        return (value, time() - start_time)
+
     def _update_value(self, worldstate):
         """Update the condition's current value to the given worldstate."""
-        worldstate.set_condition_value(self, self.get_value())
+        (value, self.last_latency) = self._poll_value()
+        self.stale = False
+        worldstate.set_condition_value(self, value)
 
 
 
     _conditions_dict = {}
 
+    _conditions_by_index = []
+
     @classmethod
     def add(cls, condition):
         assert condition._state_name not in cls._conditions_dict, \
@@ -161,10 +351,130 @@ class Condition(object):
         return '<Conditions %s>' % cls._conditions_dict
 
     @classmethod
-    def initialize_worldstate(cls, worldstate):
-        """Initialize the given worldstate with all known conditions and their current values."""
-        for condition in cls._conditions_dict.values():
-            condition._update_value(worldstate)
+    def initialize_worldstate(cls, worldstate, poller=None):
+        """Initialize the given worldstate with all known conditions and their current values.
+        See update_worldstate() for the poller and the returned list."""
+        return cls.update_worldstate(worldstate, cls._conditions_dict.values(), poller)
+
+    @classmethod
+    def update_worldstate(cls, worldstate, conditions, poller=None):
+        """Update the given worldstate with the current values of the given
+        conditions only and return the list of conditions that became stale.
+
+        Without a poller the conditions are polled one by one and none
+        becomes stale, see ConditionPoller for polling them in threads.
+
+        Each condition's last_latency tells how long its get_value() took,
+        or for stale conditions how long it was waited for.
+        """
+        conditions = list(conditions)
+        if poller is None:
+            for condition in conditions:
+                condition._update_value(worldstate)
+            return []
+        return poller.update(worldstate, conditions)
+
+
+
+class _ConditionPoll(object):
+    """A call of a condition's get_value() in a ConditionPoller's thread"""
+
+    def __init__(self):
+        self.start_time = None # set once a thread runs the call
+        self.result = None
+
+
+class ConditionPoller(object):
+    """Polls conditions in a persistent pool of threads, so that updating
+    a worldstate takes as long as the slowest condition instead of the
+    sum of all.
+
+    A condition whose get_value() does not return within timeout seconds
+    after its call started is marked stale and keeps its last known value
+    in the worldstate. The call is left running and the condition is not
+    polled again before it returned, so a hanging condition blocks only
+    one thread. A condition without a value in the worldstate yet is
+    always waited for, as the planner would take it for satisfied.
+    """
+
+    def __init__(self, threads, timeout=None):
+        """threads: number of threads, which should exceed the number of
+                    conditions that may hang
+        timeout: seconds to wait for each condition, None waits for all
+        """
+        assert threads > 0
+        self.threads = threads
+        self.timeout = timeout
+        self._pool = ThreadPool(threads)
+        self._polls = {} # condition -> _ConditionPoll not consumed yet
+
+    def close(self):
+        """stop the threads once the running calls returned"""
+        self._pool.close()
+
+    @staticmethod
+    def _run_poll(condition, poll):
+        poll.start_time = time()
+        return condition._poll_value()
+
+    def _submit(self, condition):
+        """Return the condition's running call, starting a new one if it has
+        none. A call left from an earlier update is not used once it
+        returned, as its value may be outdated by now."""
+        poll = self._polls.get(condition)
+        if poll is None or poll.result.ready():
+            poll = _ConditionPoll()
+            poll.result = self._pool.apply_async(self._run_poll, (condition, poll))
+            self._polls[condition] = poll
+        return poll
+
+    def _wait(self, poll, give_up_time):
+        """Wait until the call returned or its timeout passed, which starts
+        with the call. Calls still queued are given up at give_up_time.
+        Return whether the call returned."""
+        while not poll.result.ready():
+            if poll.start_time is not None:
+                remaining = poll.start_time + self.timeout - time()
+            else:
+                # check again soon whether a thread picked it up
+                remaining = min(give_up_time - time(), 0.005)
+            if remaining <= 0:
+                return False
+            poll.result.wait(remaining)
+        return True
+
+    def update(self, worldstate, conditions):
+        """Update the given worldstate with the current values of the given
+        conditions and return the list of conditions that became stale."""
+        submit_time = time()
+        polls = [(condition, self._submit(condition)) for condition in conditions]
+        if self.timeout is not None:
+            # the time all calls take when they run in waves of threads
+            # and each takes up its full timeout
+            waves = (len(polls) + self.threads - 1) // self.threads
+            give_up_time = submit_time + waves * self.timeout
+
+        stale_conditions = []
+        for (condition, poll) in polls:
+            try:
+                worldstate.get_condition_value(condition)
+                has_value = True
+            except KeyError:
+                has_value = False
+            if self.timeout is None or not has_value:
+                poll.result.wait()
+            elif not self._wait(poll, give_up_time):
+                condition.last_latency = time() - (poll.start_time or submit_time)
+                condition.stale = True
+                stale_conditions.append(condition)
+                _logger.warn("Condition timed out after %.3fs, keeping last known value: %s",
+                             condition.last_latency, condition)
+                continue
+            del self._polls[condition]
+            (value, condition.last_latency) = poll.result.get()
+            condition.stale = False
+            worldstate.set_condition_value(condition, value)
+        return stale_conditions
 
 
 
@@ -282,6 +592,25 @@ class Goal(object):
 # TODO: implement denial of trivial actions (not changing conditions), if they're actually concerned?
 
 class Action(object):
+    """
+    freeform_context_ttl: seconds for which is_freeform_context_valid() may
+        reuse a result of check_freeform_context(), 0 to check every time
+    static_cost: True if cost() returns the same value whenever it is
+        called, so that planners ask it only once, otherwise it is asked
+        once per planning run
+    variable_preconditions_on_effects_only: True if
+        _generate_variable_preconditions() returns preconditions on the
+        variable effects' conditions only, otherwise planners pruning
+        irrelevant actions take every condition as relevant for the action
+    """
+
+    freeform_context_ttl = 0
+
+    static_cost = False
+
+    variable_preconditions_on_effects_only = False
+
+    _freeform_context_cache = None # (check time, result)
 
     def __init__(self, preconditions, effects):
         self._preconditions = preconditions
@@ -346,6 +675,29 @@ class Action(object):
         """Override to add context checks required to run this action that cannot be satisfied by the planner."""
         return True
 
+    def is_freeform_context_valid(self):
+        """Return the result of check_freeform_context(), reusing the last
+        one while it is younger than freeform_context_ttl and was not
+        invalidated."""
+        if self.freeform_context_ttl <= 0:
+            return self.check_freeform_context()
+        check_time = time()
+        if self._has_reusable_freeform_context(check_time):
+            return self._freeform_context_cache[1]
+        valid = self.check_freeform_context()
+        self._freeform_context_cache = (check_time, valid)
+        return valid
+
+    def _has_reusable_freeform_context(self, now):
+        cache = self._freeform_context_cache
+        return (self.freeform_context_ttl > 0 and cache is not None and
+                now - cache[0] < self.freeform_context_ttl)
+
+    def invalidate_freeform_context(self):
+        """Drop the reused result of check_freeform_context(), e.g. when a
+        callback tells that the context changed."""
+        self._freeform_context_cache = None
+
     def has_satisfying_effects(self, worldstate, start_worldstate, unsatisfied_conditions):
         """Return True if at least one of own effects matches unsatisfied_conditions."""
         for effect in self._effects:
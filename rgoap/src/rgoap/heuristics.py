@@ -0,0 +1,437 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Heuristics for the regressive planner, see Heuristic
+"""
+
+
+from common import VariableEffect
+
+
+import logging
+_logger = logging.getLogger('rgoap')
+
+
+INFINITY = float('inf')
+
+
+
+class Heuristic(object):
+    """Estimates the costs of the actions still needed to reach a node's
+    worldstate from the start worldstate.
+
+    The planner calls setup() at the beginning of every planning run and
+    distance() once for every node. A distance of INFINITY marks a node
+    from which the start worldstate cannot be reached, the planner drops it.
+    """
+
+    def __init__(self):
+        self._start_worldstate = None
+        self._goal_worldstate = None
+
+    def __repr__(self):
+        return '<%s>' % self.__class__.__name__
+
+    def setup(self, actions, start_worldstate, goal_worldstate, action_cost=None):
+        """Prepare for a planning run with the given (checked) actions.
+
+        action_cost: function returning an action's cost, e.g. the planner's
+                     table of the costs asked for this run, see
+                     Action.static_cost, defaults to asking the action
+
+        Override to precompute data used by distance().
+        """
+        self._start_worldstate = start_worldstate
+        self._goal_worldstate = goal_worldstate
+
+    def distance(self, node):
+        """Return the estimated distance for the given node"""
+        raise NotImplementedError
+
+
+
+class ZeroHeuristic(Heuristic):
+    """No estimation at all, which turns A* into Dijkstra's algorithm."""
+
+    def distance(self, node):
+        return 0
+
+
+
+class RelativeDistanceHeuristic(Heuristic):
+    """Sums up the relative remaining distance of every unsatisfied numeric
+    condition and 1 for every other unsatisfied condition, at most the
+    number of unsatisfied conditions.
+
+    This is the default heuristic. It is not admissible.
+    """
+
+    def distance(self, node):
+        unsatisfied_conditions_set = node.unsatisfied_conditions
+
+        if node.is_goal():
+            # goal node: default distance 1 for each known unsatisfied condition
+            return len(unsatisfied_conditions_set)
+
+        # every other node: sum heuristics for every unsatisified condition
+        goal_worldstate = self._goal_worldstate
+        start_worldstate = self._start_worldstate
+        distance = 0
+
+        for condition in unsatisfied_conditions_set:
+            try:
+                goal_value = goal_worldstate.get_condition_value(condition)
+            except KeyError:
+                # conditions that weren't part of the goal worldstate but
+                # were involved through actions cannot be compared and get
+                # a default distance
+                distance += 1
+            else:
+                node_value = node.worldstate.get_condition_value(condition)
+                start_value = start_worldstate.get_condition_value(condition)
+                try:
+                    distance_total = abs(goal_value - start_value)
+                    distance_remaining = abs(node_value - start_value)
+                    relative_distance = float(distance_remaining) / distance_total
+                    # relative_distance will be 1 at the goal node,
+                    # be > 1 if a action moves in the wrong direction or
+                    # tend to 0 with the condition being fullfilled gradually
+                    assert relative_distance > 0, "If the relative progress" \
+                            " results to zero, why is it considered unsatisfied?"
+                except (TypeError, ZeroDivisionError):
+                    # non-numeric conditions and conditions already
+                    # satisfied by the goal get a default distance
+                    distance += 1
+                else:
+                    _logger.debug("comparing condition %s: relative_distance = "
+                                  "distance_left / distance_total = %s / %s = %s",
+                                  condition._state_name, distance_remaining,
+                                  distance_total, relative_distance)
+                    distance += relative_distance
+
+        # make sure heuristic distance is less or equal the number of conditions
+        return min(len(unsatisfied_conditions_set), distance)
+
+
+
+class _CompiledAction(object):
+    """Table entry of an action, prepared for delete relaxed reasoning.
+
+    preconditions: list of (condition, value) facts
+    effects: list of (condition, value) facts
+    variable_effects: list of VariableEffects
+    """
+    def __init__(self, action, cost):
+        self.action = action
+        self.cost = cost
+        self.preconditions = [(precondition._condition, precondition._value)
+                              for precondition in action._preconditions]
+        self.effects = []
+        self.variable_effects = []
+        for effect in action._effects:
+            if isinstance(effect, VariableEffect):
+                self.variable_effects.append(effect)
+            else:
+                self.effects.append((effect._condition, effect._new_value))
+
+    def __repr__(self):
+        return '<%s action=%s cost=%s>' % (self.__class__.__name__,
+                                           self.action, self.cost)
+
+
+
+class _CompiledActionsHeuristic(Heuristic):
+    """Base for heuristics working on the delete relaxation of the actions,
+    i.e. on facts (condition, value) reached from the start worldstate
+    while ignoring interactions between actions.
+
+    Generated preconditions of variable effects are unknown in advance and
+    therefore ignored, which only lowers the estimated costs.
+
+    The action tables are compiled once per set of actions.
+    """
+
+    def __init__(self):
+        Heuristic.__init__(self)
+        self._compiled_actions_set = frozenset()
+        self._compiled_actions = []
+        self._variable_effects = {}  # condition -> list of (VariableEffect, _CompiledAction)
+
+    def setup(self, actions, start_worldstate, goal_worldstate, action_cost=None):
+        Heuristic.setup(self, actions, start_worldstate, goal_worldstate, action_cost)
+        self._compile(actions, action_cost)
+
+    def _compile(self, actions, action_cost=None):
+        actions_set = frozenset(actions)
+        if actions_set == self._compiled_actions_set:
+            # costs might change between planning runs
+            for compiled_action in self._compiled_actions:
+                if action_cost is not None:
+                    compiled_action.cost = action_cost(compiled_action.action)
+                elif not compiled_action.action.static_cost:
+                    compiled_action.cost = compiled_action.action.cost()
+            return
+
+        if action_cost is None:
+            action_cost = lambda action: action.cost()
+        self._compiled_actions_set = actions_set
+        self._compiled_actions = [_CompiledAction(action, action_cost(action))
+                                  for action in actions]
+        self._variable_effects = {}
+        for compiled_action in self._compiled_actions:
+            for effect in compiled_action.variable_effects:
+                self._variable_effects.setdefault(effect._condition, []).append(
+                        (effect, compiled_action))
+        _logger.debug("%s compiled %d actions",
+                      self.__class__.__name__, len(self._compiled_actions))
+
+    def _get_start_value(self, condition):
+        """Return the condition's start value or raise KeyError if the
+        condition is unknown to the start worldstate (and not compared)"""
+        return self._start_worldstate.get_condition_value(condition)
+
+
+
+class _RelaxedCostHeuristic(_CompiledActionsHeuristic):
+    """Base for heuristics combining the relaxed costs of the facts needed.
+
+    The fact costs are propagated once per planning run.
+    """
+
+    def __init__(self):
+        _CompiledActionsHeuristic.__init__(self)
+        self._fact_costs = {}             # (condition, value) -> cost
+        self._variable_effect_costs = {}  # VariableEffect -> cost
+
+    def _combine(self, costs):
+        """Return the cost of reaching all facts with the given costs"""
+        raise NotImplementedError
+
+    def setup(self, actions, start_worldstate, goal_worldstate, action_cost=None):
+        _CompiledActionsHeuristic.setup(self, actions, start_worldstate, goal_worldstate,
+                                        action_cost)
+        self._calc_fact_costs()
+
+    def _calc_fact_costs(self):
+        """Propagate the costs of facts reached from the start worldstate
+        through the compiled actions until they do not improve anymore."""
+        self._fact_costs = {}
+        self._variable_effect_costs = {}
+        changed = True
+        while changed:
+            changed = False
+            for compiled_action in self._compiled_actions:
+                preconditions_cost = self._combine(
+                        [self._fact_cost(condition, value)
+                         for (condition, value) in compiled_action.preconditions])
+                if preconditions_cost == INFINITY:
+                    continue
+                cost = compiled_action.cost + preconditions_cost
+                for fact in compiled_action.effects:
+                    try:
+                        if cost < self._fact_costs.get(fact, INFINITY):
+                            self._fact_costs[fact] = cost
+                            changed = True
+                    except TypeError: # unhashable value, see _fact_cost
+                        pass
+                for effect in compiled_action.variable_effects:
+                    if cost < self._variable_effect_costs.get(effect, INFINITY):
+                        self._variable_effect_costs[effect] = cost
+                        changed = True
+
+    def _fact_cost(self, condition, value):
+        """Return the relaxed cost of reaching value for condition"""
+        try:
+            start_value = self._get_start_value(condition)
+        except KeyError:
+            return 0 # conditions unknown to the start worldstate are not compared
+        if start_value == value:
+            return 0
+
+        try:
+            cost = self._fact_costs.get((condition, value), INFINITY)
+        except TypeError:
+            return 0 # unhashable value, estimate optimistically
+        for (effect, _) in self._variable_effects.get(condition, ()):
+            effect_cost = self._variable_effect_costs.get(effect, INFINITY)
+            if effect_cost < cost and effect._is_reachable(value, start_value):
+                cost = effect_cost
+        return cost
+
+    def distance(self, node):
+        worldstate = node.worldstate
+        return self._combine([self._fact_cost(condition,
+                                              worldstate.get_condition_value(condition))
+                              for condition in node.unsatisfied_conditions])
+
+
+
+class HMaxHeuristic(_RelaxedCostHeuristic):
+    """The maximum of the relaxed costs of all unsatisfied conditions.
+
+    Admissible for the relaxed problem, but often not very informed.
+    Note that the planner's regression lets preconditions of earlier
+    actions overwrite conditions needed later, so plans found with h_max
+    are not guaranteed to be cheaper than those found with ZeroHeuristic.
+    """
+
+    def _combine(self, costs):
+        return max(costs) if len(costs) > 0 else 0
+
+
+
+class HAddHeuristic(_RelaxedCostHeuristic):
+    """The sum of the relaxed costs of all unsatisfied conditions.
+
+    Not admissible, but usually guides the search better than h_max.
+    """
+
+    def _combine(self, costs):
+        return sum(costs)
+
+
+
+class RelaxedPlanHeuristic(_CompiledActionsHeuristic):
+    """The costs of a relaxed plan as in the FF planner.
+
+    Once per planning run a delete relaxed planning graph is built from the
+    start worldstate: the first layer at which every fact is reached and
+    the action supporting it there. For every node a relaxed plan for its
+    unsatisfied conditions is extracted backwards through these layers, and
+    its action costs are summed up.
+
+    Not admissible, but usually much better informed than h_max or h_add,
+    as actions helping with several conditions are counted only once.
+    """
+
+    def __init__(self):
+        _CompiledActionsHeuristic.__init__(self)
+        self._fact_layers = {}              # (condition, value) -> layer
+        self._fact_supporters = {}          # (condition, value) -> _CompiledAction
+        self._variable_effect_layers = {}   # VariableEffect -> layer
+
+    def setup(self, actions, start_worldstate, goal_worldstate, action_cost=None):
+        _CompiledActionsHeuristic.setup(self, actions, start_worldstate, goal_worldstate,
+                                        action_cost)
+        self._build_planning_graph()
+
+    def _build_planning_graph(self):
+        """Expand the relaxed planning graph layer by layer until no more
+        actions become applicable."""
+        self._fact_layers = {}
+        self._fact_supporters = {}
+        self._variable_effect_layers = {}
+
+        pending_actions = self._compiled_actions
+        layer = 0
+        while len(pending_actions) > 0:
+            applicable_actions = []
+            remaining_actions = []
+            for compiled_action in pending_actions:
+                preconditions_layers = [self._fact_layer(condition, value)[0]
+                                        for (condition, value) in compiled_action.preconditions]
+                if all(precondition_layer <= layer
+                       for precondition_layer in preconditions_layers):
+                    # prefer supporters with preconditions reached early (FF's difficulty)
+                    applicable_actions.append((sum(preconditions_layers), compiled_action))
+                else:
+                    remaining_actions.append(compiled_action)
+            if len(applicable_actions) == 0:
+                break
+
+            applicable_actions.sort(key=lambda entry: entry[0])
+            for (_, compiled_action) in applicable_actions:
+                for fact in compiled_action.effects:
+                    try:
+                        if fact not in self._fact_layers:
+                            self._fact_layers[fact] = layer + 1
+                            self._fact_supporters[fact] = compiled_action
+                    except TypeError: # unhashable value, see _fact_layer
+                        pass
+                for effect in compiled_action.variable_effects:
+                    self._variable_effect_layers[effect] = layer + 1
+
+            pending_actions = remaining_actions
+            layer += 1
+
+        _logger.debug("%s built planning graph with %d layers",
+                      self.__class__.__name__, layer)
+
+    def _fact_layer(self, condition, value):
+        """Return (layer, supporting action) of the first layer reaching
+        value for condition, (0, None) if reached at start."""
+        try:
+            start_value = self._get_start_value(condition)
+        except KeyError:
+            return (0, None) # conditions unknown to the start worldstate are not compared
+        if start_value == value:
+            return (0, None)
+
+        try:
+            layer = self._fact_layers.get((condition, value), INFINITY)
+        except TypeError:
+            return (0, None) # unhashable value, estimate optimistically
+        supporter = self._fact_supporters.get((condition, value))
+        for (effect, compiled_action) in self._variable_effects.get(condition, ()):
+            effect_layer = self._variable_effect_layers.get(effect, INFINITY)
+            if effect_layer < layer and effect._is_reachable(value, start_value):
+                layer = effect_layer
+                supporter = compiled_action
+        return (layer, supporter)
+
+    def distance(self, node):
+        worldstate = node.worldstate
+        goals = {} # layer -> list of supporters of the facts to reach there
+        for condition in node.unsatisfied_conditions:
+            value = worldstate.get_condition_value(condition)
+            (layer, supporter) = self._fact_layer(condition, value)
+            if layer == INFINITY:
+                return INFINITY
+            if layer > 0:
+                goals.setdefault(layer, []).append(supporter)
+
+        if len(goals) == 0:
+            return 0
+
+        # extract relaxed plan backwards, counting every action only once
+        relaxed_plan = set()
+        for layer in xrange(max(goals), 0, -1):
+            for supporter in goals.get(layer, ()):
+                if supporter in relaxed_plan:
+                    continue
+                relaxed_plan.add(supporter)
+                for (condition, value) in supporter.preconditions:
+                    (precondition_layer, precondition_supporter) = self._fact_layer(condition, value)
+                    if precondition_layer > 0:
+                        # preconditions are always reached at a lower layer
+                        goals.setdefault(precondition_layer, []).append(precondition_supporter)
+
+        return sum(compiled_action.cost for compiled_action in relaxed_plan)
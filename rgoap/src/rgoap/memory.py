@@ -80,6 +80,11 @@ class MemorySetVarAction(Action):
     def __repr__(self):
         return '<%s state_name=%s new=%s>' % (self.__class__.__name__, self._state_name, self._new_value)
 
+    @property
+    def static_cost(self):
+        """True unless a subclass overrides cost(), see Action.static_cost"""
+        return type(self).cost.im_func is Action.cost.im_func
+
     def run(self, next_worldstate):
         self._memory.set_value(self._state_name, self._new_value)
 
@@ -125,6 +130,18 @@ class MemoryIncrementerAction(Action):
     def cost(self):
         return self.validate_cost(abs(2 - float(1) / abs(self._increment)))
 
+    @property
+    def static_cost(self):
+        """True unless a subclass overrides cost(), see Action.static_cost"""
+        return type(self).cost.im_func is MemoryIncrementerAction.cost.im_func
+
+    @property
+    def variable_preconditions_on_effects_only(self):
+        """True unless a subclass overrides _generate_variable_preconditions(),
+        see Action.variable_preconditions_on_effects_only"""
+        return (type(self)._generate_variable_preconditions.im_func is
+                MemoryIncrementerAction._generate_variable_preconditions.im_func)
+
     def run(self, next_worldstate):
         self._memory.set_value(self._state_name, self._memory.get_value(self._state_name) + self._increment)
 
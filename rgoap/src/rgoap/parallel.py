@@ -0,0 +1,367 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Planning in worker processes, see CompiledDomain, PlanningPool,
+plan_goals_in_parallel() and PlannerPortfolio
+"""
+
+
+import cPickle as pickle
+import multiprocessing
+from time import time, sleep
+
+from common import Condition, WorldState, Precondition, Effect, Goal, Action
+from heuristics import RelativeDistanceHeuristic, RelaxedPlanHeuristic, INFINITY
+from planning import Planner, CancellationToken
+
+
+import logging
+_logger = logging.getLogger('rgoap')
+
+
+
+class CompiledDomain(object):
+    """A picklable copy of what the planner needs of a domain.
+
+    Conditions are replaced by their state names and actions by their
+    preconditions, effects and cost, as plain values. So the domain can be
+    shipped to worker processes, which rebuild it with plain conditions and
+    actions. Plans found there are returned as indices into the list of
+    actions given here.
+
+    Everything that is asked at planning time is fixed at compile time:
+    actions whose freeform context fails are left out and the actions' costs
+    are taken once. Actions with variable effects or with own precondition
+    handling, and preconditions or effects of own classes, cannot be
+    compiled, which raises a ValueError.
+    """
+
+    def __init__(self, actions, worldstate, goals):
+        self.start_values = [(condition._state_name, value)
+                             for (condition, value) in worldstate.iteritems()]
+        self.actions = []
+        for (index, action) in enumerate(actions):
+            self._check_action(action)
+            if not action.is_freeform_context_valid():
+                continue
+            self.actions.append((index,
+                                 [self._compile_precondition(precondition)
+                                  for precondition in action._preconditions],
+                                 [(effect._condition._state_name, effect._new_value)
+                                  for effect in action._effects],
+                                 action.cost()))
+        self.goals = [[self._compile_precondition(precondition)
+                       for precondition in goal._preconditions]
+                      for goal in goals]
+
+    def __repr__(self):
+        return '<%s conditions=%d actions=%d goals=%d>' % (self.__class__.__name__,
+                    len(self.start_values), len(self.actions), len(self.goals))
+
+    @staticmethod
+    def _check_action(action):
+        for method in ['apply_preconditions', 'has_satisfying_effects']:
+            if getattr(type(action), method).im_func is not getattr(Action, method).im_func:
+                raise ValueError("Cannot compile action overriding %s(): %r" % (method, action))
+        for effect in action._effects:
+            if type(effect) is not Effect:
+                raise ValueError("Cannot compile effect: %r" % effect)
+
+    @staticmethod
+    def _compile_precondition(precondition):
+        if type(precondition) is not Precondition:
+            raise ValueError("Cannot compile precondition: %r" % precondition)
+        return (precondition._condition._state_name, precondition._value,
+                precondition._deviation)
+
+    def build(self):
+        """Return (actions, worldstate, goals) rebuilt from plain conditions,
+        with each action's index attribute telling its compiled index"""
+        conditions = {}
+        worldstate = WorldState()
+        for (state_name, value) in self.start_values:
+            conditions[state_name] = _get_compiled_condition(state_name)
+            worldstate.set_condition_value(conditions[state_name], value)
+
+        def preconditions(compiled_preconditions):
+            return [Precondition(conditions[state_name], value, deviation)
+                    for (state_name, value, deviation) in compiled_preconditions]
+
+        actions = set()
+        for (index, compiled_preconditions, compiled_effects, cost) in self.actions:
+            actions.add(_CompiledAction(index, preconditions(compiled_preconditions),
+                                        [Effect(conditions[state_name], value)
+                                         for (state_name, value) in compiled_effects],
+                                        cost))
+        goals = [Goal(preconditions(compiled_goal)) for compiled_goal in self.goals]
+        return (actions, worldstate, goals)
+
+
+
+class _CompiledCondition(Condition):
+    """Stand-in for a compiled condition, which may share its state name
+    with a known condition and is therefore not checked against them"""
+
+    def __init__(self, state_name):
+        self._state_name = state_name
+        self._index = len(Condition._conditions_by_index)
+        Condition._conditions_by_index.append(self)
+
+
+# state name -> _CompiledCondition, shared by all domains built in a process,
+# as interned conditions are never dropped and persistent workers build many
+_compiled_conditions = {}
+
+def _get_compiled_condition(state_name):
+    condition = _compiled_conditions.get(state_name)
+    if condition is None:
+        condition = _compiled_conditions[state_name] = _CompiledCondition(state_name)
+    return condition
+
+
+
+class _CompiledAction(Action):
+    """Stand-in for a compiled action in a worker process, never run"""
+
+    def __init__(self, index, preconditions, effects, cost):
+        Action.__init__(self, preconditions, effects)
+        self.index = index
+        self._cost = cost
+
+    def __repr__(self):
+        return '<%s index=%d>' % (self.__class__.__name__, self.index)
+
+    def cost(self):
+        return self._cost
+
+
+
+class PlanningPool(object):
+    """A pool of worker processes planning for compiled domains.
+
+    It is kept across searches, as forking a big process, e.g. a ROS node
+    with its threads, for every search is costly. Searches still running
+    can be cancelled through a shared event the workers' planners poll,
+    which leaves the workers ready for the next searches.
+    """
+
+    def __init__(self, processes=None):
+        self._cancelled = multiprocessing.Event()
+        self._pool = multiprocessing.Pool(processes, _init_worker, (self._cancelled,))
+        self._results = []
+
+    def __repr__(self):
+        return '<%s pending=%d>' % (self.__class__.__name__, len(self._results))
+
+    def apply_async(self, pickled_domain, goal_index, heuristic_class, budget, weight=1):
+        """Start planning for a goal of the pickled CompiledDomain and
+        return the AsyncResult of _plan_compiled_goal()"""
+        result = self._pool.apply_async(_plan_compiled_goal, (pickled_domain, goal_index,
+                                                              heuristic_class, budget, weight))
+        self._results.append(result)
+        return result
+
+    def cancel(self):
+        """Cancel the searches still running or queued and wait for them
+        to stop"""
+        if not all(result.ready() for result in self._results):
+            self._cancelled.set()
+            for result in self._results:
+                result.wait()
+            self._cancelled.clear()
+        self._results = []
+
+    def close(self):
+        """Stop the worker processes, the pool cannot be used afterwards"""
+        self._pool.terminate()
+        self._pool.join()
+
+
+
+# set in worker processes by PlanningPool
+_worker_cancelled = None
+
+def _init_worker(cancelled):
+    global _worker_cancelled
+    _worker_cancelled = cancelled
+
+
+def _plan_compiled_goal(pickled_domain, goal_index, heuristic_class, budget, weight=1):
+    """Worker process entry: plan for a goal of the pickled CompiledDomain
+    and return (action indices in execution order or None, PlanningStatistics)"""
+    (actions, worldstate, goals) = pickle.loads(pickled_domain).build()
+    planner = Planner(actions, worldstate, goals[goal_index], heuristic_class(), budget)
+    if _worker_cancelled is not None:
+        # the budget is the worker's own copy
+        planner.budget.cancellation = CancellationToken([_worker_cancelled.is_set])
+    start_node = planner.plan(weight=weight)
+    if start_node is None:
+        return (None, planner.last_stats)
+    return ([action.index for action in reversed(start_node.parent_actions_path_list)],
+            planner.last_stats)
+
+
+def plan_goals_in_parallel(domain, heuristic_class, budget=None, processes=None,
+                           preempt_requested=None, pool=None):
+    """Plan for all goals of the CompiledDomain in a pool of worker processes
+    and return (goal index, action indices, PlanningStatistics) for the
+    first goal in the domain's list that has a plan, or None if no goal has
+    one or if preempt_requested(), a function polled while waiting, tells so.
+
+    Goals are queued in their order, so with fewer processes than goals the
+    first ones are searched first. The searches for the goals after the one
+    returned are cancelled.
+
+    heuristic_class: the Heuristic each worker plans with
+    budget: the PlanningBudget for each goal, None for the planner's default
+    processes: number of worker processes, defaults to the number of CPUs
+    pool: the PlanningPool to plan in, by default one is created for this
+          call only, ignoring processes otherwise
+    """
+    pickled_domain = pickle.dumps(domain, pickle.HIGHEST_PROTOCOL)
+    own_pool = pool is None
+    if own_pool:
+        pool = PlanningPool(processes)
+    try:
+        results = [pool.apply_async(pickled_domain, goal_index, heuristic_class, budget)
+                   for goal_index in range(len(domain.goals))]
+        for (goal_index, result) in enumerate(results):
+            while not result.ready():
+                if preempt_requested is not None and preempt_requested():
+                    return None
+                result.wait(0.01)
+            (action_indices, stats) = result.get()
+            _logger.info("Goal #%d planned in worker: %s", goal_index, stats)
+            if action_indices is not None:
+                return (goal_index, action_indices, stats)
+        return None
+    finally:
+        if own_pool:
+            pool.close()
+        else:
+            pool.cancel()
+
+
+
+class PlannerPortfolio(object):
+    """Front end to the Planner that races several search configurations
+    for the same goal in worker processes, as it is hard to tell in advance
+    which one suits a goal best.
+
+    configurations: list of (name, heuristic class, weight), see
+                    Planner.plan() for the weight
+    budget: the PlanningBudget for each configuration, None for the
+            planner's default
+    processes: number of worker processes, defaults to one per configuration,
+               kept in a PlanningPool until close()
+    last_winner: name of the configuration whose plan plan() returned last
+    last_results: list of (name, PlanningStatistics) of the configurations
+                  that finished during the last plan()
+    wins: dict from configuration names to the number of plans returned,
+          for tuning the portfolio
+    """
+
+    DEFAULT_CONFIGURATIONS = [('greedy', RelaxedPlanHeuristic, INFINITY),
+                              ('weighted A*', RelaxedPlanHeuristic, 5),
+                              ('A*', RelativeDistanceHeuristic, 1)]
+
+    def __init__(self, actions, worldstate, goal, configurations=None, budget=None,
+                 processes=None):
+        self.planner = Planner(actions, worldstate, goal)
+        self.configurations = (configurations if configurations is not None
+                               else self.DEFAULT_CONFIGURATIONS)
+        self.budget = budget
+        self.processes = processes if processes is not None else len(self.configurations)
+        self._pool = None # created on first use
+        self.last_winner = None
+        self.last_results = []
+        self.wins = dict((name, 0) for (name, _, _) in self.configurations)
+
+    def plan(self, start_worldstate=None, goal=None, time_limit=None):
+        """Race the configurations and return the start node of a plan or None.
+
+        Without a time_limit the first plan found is returned. Otherwise the
+        cheapest plan found within time_limit seconds is returned, which is
+        known earlier if all configurations finish before.
+
+        The domain is compiled into a CompiledDomain, which raises a
+        ValueError if that is not possible.
+        """
+        start_time = time()
+        if start_worldstate is not None:
+            self.planner._start_worldstate = start_worldstate
+        if goal is not None:
+            self.planner._goal = goal
+        actions = list(self.planner._actions)
+        domain = CompiledDomain(actions, self.planner._start_worldstate, [self.planner._goal])
+        pickled_domain = pickle.dumps(domain, pickle.HIGHEST_PROTOCOL)
+
+        self.last_winner = None
+        self.last_results = []
+        best = None # (cost, name, action indices)
+        if self._pool is None:
+            self._pool = PlanningPool(self.processes)
+        try:
+            pending = [(name, self._pool.apply_async(pickled_domain, 0, heuristic_class,
+                                                     self.budget, weight))
+                       for (name, heuristic_class, weight) in self.configurations]
+            while len(pending) > 0:
+                if time_limit is not None and time() - start_time >= time_limit:
+                    break
+                for (name, result) in [entry for entry in pending if entry[1].ready()]:
+                    pending.remove((name, result))
+                    (action_indices, stats) = result.get()
+                    _logger.info("Portfolio configuration '%s' finished: %s", name, stats)
+                    self.last_results.append((name, stats))
+                    if action_indices is not None:
+                        cost = stats.plans[-1][1]
+                        if best is None or cost < best[0]:
+                            best = (cost, name, action_indices)
+                if best is not None and time_limit is None:
+                    break
+                sleep(0.001)
+        finally:
+            # cancels the configurations still searching
+            self._pool.cancel()
+
+        if best is None:
+            _logger.warn("Portfolio found no plan, finished: %s",
+                         [name for (name, _) in self.last_results])
+            return None
+        (_, self.last_winner, action_indices) = best
+        self.wins[self.last_winner] += 1
+        _logger.info("Portfolio configuration '%s' won", self.last_winner)
+        return self.planner.regress_plan([actions[index] for index in action_indices])
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
@@ -0,0 +1,316 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Caches of plans found before, see PlanCache and PlanStore
+"""
+
+
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+from time import time
+
+from common import Condition
+
+
+import logging
+_logger = logging.getLogger('rgoap')
+
+
+
+class PlanCache(object):
+    """Least recently used cache of plans, keyed by goal and start worldstate.
+
+    A plan stays valid for every start worldstate that matches its start
+    node's worldstate. So only the values of the conditions set in the start
+    node's worldstate, which the plan depends on, are part of the key,
+    together with the goal's preconditions.
+
+    Plans are stored as lists of actions. On reuse the planner rebuilds
+    their nodes, which revalidates them against the current worldstate.
+    The cache is cleared whenever the set of actions differs from the one
+    the cached plans were found with.
+
+    max_size: maximum number of plans cached
+    hits, misses: number of lookups that did or did not return a plan
+    """
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # (goal key, conditions, values) -> actions, least recently used first
+        self._plans = OrderedDict()
+        # goal key -> {conditions: number of cached plans depending on them}
+        self._dependencies = {}
+        self._actions = frozenset()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def __repr__(self):
+        return '<%s size=%d/%d hits=%d misses=%d>' % (self.__class__.__name__,
+                    len(self._plans), self.max_size, self.hits, self.misses)
+
+    def clear(self):
+        self._plans.clear()
+        self._dependencies.clear()
+
+    def get(self, planner, goal, worldstate, actions):
+        """Return the start node of a cached plan for the given goal that is
+        valid in the given worldstate, rebuilt by the given planner, or None.
+        """
+        self._check_actions(actions)
+        try:
+            goal_key = self._goal_key(goal)
+            dependencies = list(self._dependencies.get(goal_key, ()))
+        except TypeError: # unhashable value
+            dependencies = []
+
+        for conditions in dependencies:
+            try:
+                key = (goal_key, conditions, self._project(worldstate, conditions))
+                plan_actions = self._plans.pop(key)
+            except (KeyError, TypeError):
+                continue
+
+            start_node = planner.regress_plan(plan_actions, worldstate, goal)
+            if start_node is None:
+                _logger.info("Dropping invalid cached plan: %s", plan_actions)
+                self._forget(key)
+                continue
+
+            self._plans[key] = plan_actions # now the most recently used
+            self.hits += 1
+            _logger.info("Reusing cached plan: %s", plan_actions)
+            return start_node
+
+        self.misses += 1
+        return None
+
+    def put(self, goal, start_node, actions):
+        """Cache the plan starting with the given node, which was found for
+        the given goal with the given set of actions."""
+        self._check_actions(actions)
+        conditions = tuple(sorted((condition for (condition, _) in start_node.worldstate.iteritems()),
+                                  key=lambda condition: condition._index))
+        try:
+            goal_key = self._goal_key(goal)
+            key = (goal_key, conditions, self._project(start_node.worldstate, conditions))
+            if key in self._plans:
+                del self._plans[key]
+            else:
+                dependencies = self._dependencies.setdefault(goal_key, {})
+                dependencies[conditions] = dependencies.get(conditions, 0) + 1
+        except TypeError: # unhashable value
+            return
+        # the path list begins at the goal, store the actions in execution order
+        self._plans[key] = start_node.parent_actions_path_list[::-1]
+
+        while len(self._plans) > self.max_size:
+            (key, _) = self._plans.popitem(last=False)
+            self._forget(key, False)
+
+    def _check_actions(self, actions):
+        actions = frozenset(actions)
+        if actions != self._actions:
+            if len(self._plans) > 0:
+                _logger.info("Clearing plan cache as actions changed")
+            self.clear()
+            self._actions = actions
+
+    def _forget(self, key, remove_plan=True):
+        """Remove the plan and its dependency entry"""
+        if remove_plan:
+            self._plans.pop(key, None)
+        (goal_key, conditions, _) = key
+        dependencies = self._dependencies[goal_key]
+        dependencies[conditions] -= 1
+        if dependencies[conditions] == 0:
+            del dependencies[conditions]
+            if len(dependencies) == 0:
+                del self._dependencies[goal_key]
+
+    def _goal_key(self, goal):
+        return frozenset((precondition._condition, precondition._value, precondition._deviation)
+                         for precondition in goal._preconditions)
+
+    def _project(self, worldstate, conditions):
+        """Return the worldstate's values of the given conditions, raise
+        KeyError if one is missing"""
+        return tuple(worldstate.get_condition_value(condition) for condition in conditions)
+
+
+
+class PlanStore(object):
+    """Plans kept in an SQLite database, so they survive restarts.
+
+    Plans are keyed as in the PlanCache. As actions are created anew on
+    every start, they are stored by their repr() and the set of actions is
+    identified by a fingerprint of all their reprs. So plans are only found
+    for the same set of actions. If reprs change between runs or are not
+    unique within the set, the store just misses. Plans are revalidated by
+    rebuilding them with the planner before reuse.
+
+    The database is opened on first use. When it holds more than max_size
+    plans the least recently used ones are deleted.
+
+    hits, misses: number of lookups that did or did not return a plan
+    """
+
+    def __init__(self, path, max_size=1000):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._actions = frozenset()
+        self._actions_by_name = {}
+        self._fingerprint = None
+
+    def __repr__(self):
+        return '<%s path=%s max_size=%d hits=%d misses=%d>' % (self.__class__.__name__,
+                    self.path, self.max_size, self.hits, self.misses)
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM plans').fetchone()[0]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, planner, goal, worldstate, actions):
+        """Return the start node of a stored plan for the given goal that is
+        valid in the given worldstate, rebuilt by the given planner, or None.
+        """
+        if not self._check_actions(actions):
+            self.misses += 1
+            return None
+
+        connection = self._connect()
+        goal_key = self._goal_key(goal)
+        dependencies = connection.execute('SELECT DISTINCT conditions FROM plans '
+                                          'WHERE fingerprint = ? AND goal = ?',
+                                          (self._fingerprint, goal_key)).fetchall()
+        for (conditions,) in dependencies:
+            try:
+                state = self._project(worldstate, json.loads(conditions))
+            except KeyError:
+                continue
+            key = (self._fingerprint, goal_key, conditions, state)
+            row = connection.execute('SELECT actions FROM plans WHERE fingerprint = ? AND '
+                                     'goal = ? AND conditions = ? AND state = ?', key).fetchone()
+            if row is None:
+                continue
+
+            plan_actions = [self._actions_by_name[name] for name in json.loads(row[0])]
+            start_node = planner.regress_plan(plan_actions, worldstate, goal)
+            if start_node is None:
+                _logger.info("Deleting invalid stored plan: %s", plan_actions)
+                connection.execute('DELETE FROM plans WHERE fingerprint = ? AND '
+                                   'goal = ? AND conditions = ? AND state = ?', key)
+                connection.commit()
+                continue
+
+            connection.execute('UPDATE plans SET last_used = ? WHERE fingerprint = ? AND '
+                               'goal = ? AND conditions = ? AND state = ?', (time(),) + key)
+            connection.commit()
+            self.hits += 1
+            _logger.info("Reusing stored plan: %s", plan_actions)
+            return start_node
+
+        self.misses += 1
+        return None
+
+    def put(self, goal, start_node, actions):
+        """Store the plan starting with the given node, which was found for
+        the given goal with the given set of actions."""
+        if not self._check_actions(actions):
+            return
+        state_names = sorted(condition._state_name
+                             for (condition, _) in start_node.worldstate.iteritems())
+        try:
+            state = self._project(start_node.worldstate, state_names)
+        except KeyError as e: # could not be loaded again
+            _logger.info("Plan not stored as it depends on an unknown condition: %s", e)
+            return
+        plan_actions = json.dumps([repr(action)
+                                   for action in start_node.parent_actions_path_list[::-1]])
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?)',
+                           (self._fingerprint, self._goal_key(goal), json.dumps(state_names),
+                            state, plan_actions, time()))
+        connection.execute('DELETE FROM plans WHERE rowid IN (SELECT rowid FROM plans '
+                           'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_size,))
+        connection.commit()
+
+    def _connect(self):
+        if self._connection is None:
+            _logger.info("Opening plan store: %s", self.path)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS plans ('
+                                     'fingerprint TEXT, goal TEXT, conditions TEXT, '
+                                     'state TEXT, actions TEXT, last_used REAL, '
+                                     'PRIMARY KEY (fingerprint, goal, conditions, state))')
+            self._connection.commit()
+        return self._connection
+
+    def _check_actions(self, actions):
+        """Update the fingerprint if the actions changed, return whether
+        plans can be stored for them"""
+        actions = frozenset(actions)
+        if actions != self._actions:
+            self._actions = actions
+            self._actions_by_name = dict((repr(action), action) for action in actions)
+            if len(self._actions_by_name) < len(actions):
+                _logger.warn("Plan store not used as actions share the same repr")
+                self._fingerprint = None
+            else:
+                self._fingerprint = hashlib.sha1('\n'.join(sorted(self._actions_by_name))).hexdigest()
+        return self._fingerprint is not None
+
+    def _goal_key(self, goal):
+        return repr(sorted((precondition._condition._state_name, precondition._value,
+                            precondition._deviation)
+                           for precondition in goal._preconditions))
+
+    def _project(self, worldstate, state_names):
+        """Return the repr of the worldstate's values of the given
+        conditions, raise KeyError if one is unknown or missing"""
+        values = []
+        for state_name in state_names:
+            condition = Condition._conditions_dict.get(state_name)
+            if condition is None:
+                raise KeyError(state_name)
+            values.append(worldstate.get_condition_value(condition))
+        return repr(values)
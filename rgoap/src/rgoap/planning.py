@@ -33,39 +33,68 @@ Regressive A* planner with Node, Planner and PlanExecutor
 """
 
 
-from collections import deque
+import heapq
+from itertools import count
+from multiprocessing.pool import ThreadPool
+from time import time
 
-from rgoap import WorldState
+from rgoap import Condition, WorldState, VariableEffect
+from common import check_freeform_contexts
+from heuristics import RelativeDistanceHeuristic, INFINITY
 
 
 import logging
 _logger = logging.getLogger('rgoap')
 
 
+# outcomes of a planning run, see PlanningStatistics.status
+PLAN_FOUND = 'plan_found'
+NO_PLAN = 'no_plan'
+BUDGET_EXHAUSTED = 'budget_exhausted'
+
+
 
 class Node(object):
     """
     worldstate: states at this node
     action: action that led (regressively) to this node (and that should be run when executing this path forwards)
+    parent: node this node was (regressively) derived from, i.e. the next node when executing the plan
     possible_prev_nodes: nodes with actions that the planner found possible to help reach this node
                             (empty until planner ran, used for visualization/debugging)
+    unsatisfied_conditions: frozenset of conditions that differ between this node's and the
+                            start worldstate, derived from the parent's set (None until calculated)
     parent_nodes_path_list: nodes that led (from the goal) to this node
     parent_actions_path_list: actions that led (from the goal) to this node
-    note that the parent path lists begin with the goal node and end with this node's parent
+    note that the parent path lists begin with the goal node and end with this node's parent,
+    they are rebuilt from the parent references on every access
+    suboptimality_bound: set on start nodes returned by the planner, the factor by which
+                            the plan's cost may exceed the cost of an optimal plan (only
+                            valid if the heuristic is admissible, None for other nodes)
+
+    The action's cost is asked only once, when the node is created, unless
+    it is given, and the path cost is accumulated from the parent's path cost.
 
     if this node is the goal node:
-    - the action is None
+    - the action and the parent are None
     - the path lists are empty
-    - also, cost() and heuristic_distance are zero
+    - also, cost() and path_cost() are zero
     """
-    def __init__(self, worldstate, action, parent_nodes_path_list, parent_actions_path_list):
+    def __init__(self, worldstate, action, parent=None, cost=None):
         self.worldstate = worldstate
         self.action = action
+        self.parent = parent
         self.possible_prev_nodes = []
-        self.parent_nodes_path_list = parent_nodes_path_list
-        self.parent_actions_path_list = parent_actions_path_list
+        self.unsatisfied_conditions = None
+
+        if parent is None:
+            self._cost = 0
+            self._path_cost = 0
+        else:
+            self._cost = cost if cost is not None else action.cost()
+            self._path_cost = parent._path_cost + self._cost
 
         self.heuristic_distance = None
+        self.suboptimality_bound = None
 
     def __str__(self):
         return 'Node %X tCost=%d' % (id(self), self.total_cost())
@@ -81,186 +110,1286 @@ class Node(object):
         return self.action is None
 
     def parent_node(self):
-        return self.parent_nodes_path_list[-1]
+        return self.parent
+
+    @property
+    def parent_nodes_path_list(self):
+        """See class description"""
+        nodes = []
+        node = self.parent
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+    @property
+    def parent_actions_path_list(self):
+        """See class description"""
+        actions = []
+        node = self
+        while node.parent is not None:
+            actions.append(node.action)
+            node = node.parent
+        actions.reverse()
+        return actions
 
     def cost(self):
         """The cost of this node's action"""
-        return 0 if self.is_goal() else self.action.cost()
+        return self._cost
 
     def path_cost(self):
-        """Path cost calculation"""
-        return self.cost() + sum(node.cost() for node in self.parent_nodes_path_list)
+        """The costs of all actions from this node to the goal"""
+        return self._path_cost
 
     def total_cost(self):
         """Path costs plus heuristic distance"""
         return self.path_cost() + self.heuristic_distance
 
-    def _calc_heuristic_distance_for_node(self, start_worldstate):
-        # TODO: integrate heuristic calculation nicely
-        """Set self.heuristic_distance, a value representing the difference
-        between this node's worldstate and the given start worldstate.
-        """
-        assert self.heuristic_distance is None, "Node heuristic should be calculated only once"
+    def _calc_unsatisfied_conditions(self, start_worldstate, changed_conditions=None):
+        """Set self.unsatisfied_conditions.
 
-        # check which conditions differ between start and current node
-        unsatisfied_conditions_set = self.worldstate.get_unsatisfied_conditions(start_worldstate)
+        If changed_conditions lists every condition whose value differs
+        between this node's and its parent's worldstate, only these are
+        compared and the result is derived from the parent's set.
+        """
+        if changed_conditions is None or self.parent is None:
+            self.unsatisfied_conditions = frozenset(
+                    self.worldstate.get_unsatisfied_conditions(start_worldstate))
+            return
 
-        if self.is_goal():
-            # goal node: default distance 1 for each known unsatisfied condition
-            self.heuristic_distance = len(unsatisfied_conditions_set)
-        else:
-            # every other node: sum heuristics for every unsatisified condition
-            goal_worldstate = self.parent_nodes_path_list[0].worldstate
-            self.heuristic_distance = 0
+        self._update_unsatisfied_conditions(self.parent.unsatisfied_conditions,
+                                            start_worldstate, changed_conditions)
 
-            for condition in unsatisfied_conditions_set:
+    def _update_unsatisfied_conditions(self, unsatisfied_conditions, start_worldstate,
+                                       changed_conditions):
+        """Set self.unsatisfied_conditions to the given set, with the given
+        conditions compared again between this node's and the start worldstate.
+        """
+        if len(changed_conditions) > 0:
+            unsatisfied_conditions = set(unsatisfied_conditions)
+            for condition in changed_conditions:
                 try:
-                    goal_value = goal_worldstate.get_condition_value(condition)
+                    unsatisfied = (self.worldstate.get_condition_value(condition) !=
+                                   start_worldstate.get_condition_value(condition))
                 except KeyError:
-                    # conditions that weren't part of the goal worldstate but
-                    # were involved through actions cannot be compared and get
-                    # a default distance
-                    self.heuristic_distance += 1
+                    unsatisfied = False # only conditions in both worldstates are compared
+                if unsatisfied:
+                    unsatisfied_conditions.add(condition)
                 else:
-                    node_value = self.worldstate.get_condition_value(condition)
-                    start_value = start_worldstate.get_condition_value(condition)
-                    try:
-                        distance_total = abs(goal_value - start_value)
-                        distance_remaining = abs(node_value - start_value)
-                        relative_distance = float(distance_remaining) / distance_total
-                        # relative_distance will be 1 at the goal node,
-                        # be > 1 if a action moves in the wrong direction or
-                        # tend to 0 with the condition being fullfilled gradually
-                        assert relative_distance > 0, "If the relative progress" \
-                                " results to zero, why is it considered unsatisfied?"
-                    except TypeError:
-                        # non-numeric conditions get a default distance
-                        self.heuristic_distance += 1
-                    else:
-                        _logger.debug("comparing condition %s: relative_distance = "
-                                      "distance_left / distance_total = %s / %s = %s",
-                                      condition._state_name, distance_remaining,
-                                      distance_total, relative_distance)
-                        self.heuristic_distance += relative_distance
+                    unsatisfied_conditions.discard(condition)
+            unsatisfied_conditions = frozenset(unsatisfied_conditions)
+        self.unsatisfied_conditions = unsatisfied_conditions
 
-            # make sure heuristic distance is less or equal the number of conditions
-            self.heuristic_distance = min(len(unsatisfied_conditions_set), self.heuristic_distance)
+    def _calc_heuristic_distance_for_node(self, heuristic):
+        """Set self.heuristic_distance, a value representing the difference
+        between this node's worldstate and the start worldstate, as
+        estimated by the given heuristic.
+        """
+        assert self.heuristic_distance is None, "Node heuristic should be calculated only once"
+        self.heuristic_distance = heuristic.distance(self)
 
     # regressive planning
-    def get_child_nodes(self, actions, start_worldstate):
+    def get_child_nodes(self, actions, start_worldstate, heuristic, action_cost=None):
         """Returns a list of nodes that are childs of this node and
         contain the given action and start worldstate.
+
+        action_cost: function returning an action's cost, defaults to asking
+                     the action
         """
         assert len(self.possible_prev_nodes) == 0, "Node.get_child_nodes is probably not safe to be called twice"
         for action in actions:
-            nodes_path_list = self.parent_nodes_path_list[:]
-            nodes_path_list.append(self)
-            actions_path_list = self.parent_actions_path_list[:]
-            actions_path_list.append(action)
-            worldstatecopy = WorldState(self.worldstate)
-            action.apply_preconditions(worldstatecopy, start_worldstate)
-            node = Node(worldstatecopy, action, nodes_path_list, actions_path_list)
-            node._calc_heuristic_distance_for_node(start_worldstate)
-            self.possible_prev_nodes.append(node)
+            self.possible_prev_nodes.append(self._create_child_node(action, start_worldstate,
+                                                                    heuristic, action_cost))
         return self.possible_prev_nodes
 
+    def _create_child_node(self, action, start_worldstate, heuristic, action_cost=None):
+        """Return a new child node for the given action, without adding it
+        to possible_prev_nodes"""
+        worldstatecopy = WorldState(self.worldstate)
+        worldstatecopy.record_changes()
+        action.apply_preconditions(worldstatecopy, start_worldstate)
+        node = Node(worldstatecopy, action, self,
+                    action_cost(action) if action_cost is not None else None)
+        node._calc_unsatisfied_conditions(start_worldstate, worldstatecopy.pop_changes())
+        node._calc_heuristic_distance_for_node(heuristic)
+        return node
+
+
+
+def _get_conditions(worldstate):
+    return [condition for (condition, _) in worldstate.iteritems()]
+
+
+
+class _OpenList(object):
+    """Priority queue of nodes ordered by their total cost.
+
+    Nodes with equal total cost are popped in the order they were pushed,
+    so older nodes are preferred to newer nodes of the same weight.
+
+    With a weight other than 1 the heuristic distance is inflated by that
+    factor, as in weighted A*. An infinite weight orders by the heuristic
+    distance alone, breaking ties by path cost (greedy best-first search).
+    """
+    def __init__(self, nodes=(), weight=1):
+        self._heap = []
+        self._counter = count()
+        self.weight = weight
+        for node in nodes:
+            self.push(node)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.nodes())
+
+    def _priority(self, node):
+        if self.weight == 1:
+            return node.total_cost()
+        if self.weight == INFINITY:
+            return (node.heuristic_distance, node.path_cost())
+        return node.path_cost() + self.weight * node.heuristic_distance
+
+    def push(self, node):
+        heapq.heappush(self._heap, (self._priority(node), next(self._counter), node))
+
+    def pop(self):
+        """Remove and return the node with the least total cost"""
+        return heapq.heappop(self._heap)[2]
+
+    def min_priority(self):
+        """Return the (weighted) total cost of the next node to pop, which
+        with an infinite weight is infinite unless the node is a goal"""
+        priority = self._heap[0][0]
+        if self.weight == INFINITY:
+            (heuristic_distance, path_cost) = priority
+            return path_cost if heuristic_distance == 0 else INFINITY
+        return priority
+
+    def set_weight(self, weight, nodes=()):
+        """Reorder all nodes for the given weight and add the given nodes.
+
+        Nodes keep their insertion order among equally weighted nodes.
+        """
+        old_nodes = [entry[2] for entry in sorted(self._heap, key=lambda entry: entry[1])]
+        self._heap = []
+        self.weight = weight
+        for node in old_nodes:
+            self.push(node)
+        for node in nodes:
+            self.push(node)
+
+    def nodes(self):
+        """Return a list of all nodes in pop order (expensive, for debugging)"""
+        return [entry[2] for entry in sorted(self._heap)]
+
+
+
+class _BoundedTable(object):
+    """Dictionary that ignores new keys once it holds max_size entries.
+
+    Keys that cannot be hashed are ignored as well.
+    """
+    def __init__(self, max_size):
+        self._table = {}
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self._table)
+
+    def get(self, key):
+        try:
+            return self._table.get(key)
+        except TypeError: # unhashable
+            return None
+
+    def put(self, key, value):
+        try:
+            if len(self._table) < self.max_size or key in self._table:
+                self._table[key] = value
+        except TypeError: # unhashable
+            pass
+
+
+
+class _SearchGraph(object):
+    """What a search leaves behind for Planner.replan() to repair
+
+    expanded_nodes: dict from expanded nodes to the actions whose child
+                    nodes were generated and not dead ends
+    dead_end_parents: expanded nodes with child nodes that were dead ends
+    best_path_costs: transposition table, the least path cost found for
+                     each worldstate (path costs do not depend on the start)
+    initial_size: number of worldstates the search that created the graph
+                  reached, set by the first replan()
+    """
+    def __init__(self, goal, actions, checked_actions, start_worldstate, goal_node):
+        self.goal = goal
+        self.actions = frozenset(actions)
+        self.checked_actions = frozenset(checked_actions)
+        self.start_worldstate = WorldState(start_worldstate)
+        self.goal_node = goal_node
+        self.expanded_nodes = {}
+        self.dead_end_parents = set()
+        self.best_path_costs = {goal_node.worldstate: goal_node.path_cost()}
+        self.initial_size = None
+
+
+
+class CancellationToken(object):
+    """Lets a search be cancelled from outside the planner, see PlanningBudget
+
+    checks: functions that cancel the search if any of them returns True,
+            e.g. a runner's preempt_requested()
+    poll_interval: number of expansions after which the planner polls
+                   the token again, 0 or 1 polls it on every expansion
+    """
+
+    def __init__(self, checks=(), poll_interval=10):
+        self.checks = list(checks)
+        self.poll_interval = poll_interval
+        self._cancelled = False
+
+    def __repr__(self):
+        return '<%s cancelled=%s checks=%s poll_interval=%s>' % (
+                    self.__class__.__name__, self._cancelled, self.checks, self.poll_interval)
+
+    def cancel(self):
+        """Cancel the searches polling this token until reset() is called"""
+        self._cancelled = True
+
+    def reset(self):
+        self._cancelled = False
+
+    def is_cancelled(self):
+        return self._cancelled or any(check() for check in self.checks)
+
+
+
+class PlanningBudget(object):
+    """Limits for a single run of the planner, None meaning no limit
+
+    time_limit: seconds the planner may run
+    max_expansions: number of nodes the planner may expand
+    max_generated_nodes: number of nodes the planner may generate
+    max_live_nodes: number of nodes the planner may keep at the same time
+    cancellation: a CancellationToken, which stops the planner like an
+                  exhausted limit named 'cancelled'
+
+    The limits are checked before each expansion, so the node limits can be
+    exceeded by the child nodes of the last expanded node. The cancellation
+    token is polled every poll_interval expansions only.
+    """
+
+    def __init__(self, time_limit=None, max_expansions=None,
+                 max_generated_nodes=None, max_live_nodes=None, cancellation=None):
+        self.time_limit = time_limit
+        self.max_expansions = max_expansions
+        self.max_generated_nodes = max_generated_nodes
+        self.max_live_nodes = max_live_nodes
+        self.cancellation = cancellation
+        self._deadline = None
+
+    def __repr__(self):
+        return '<%s time_limit=%s max_expansions=%s max_generated=%s max_live=%s cancellation=%s>' % (
+                    self.__class__.__name__, self.time_limit, self.max_expansions,
+                    self.max_generated_nodes, self.max_live_nodes, self.cancellation)
+
+    def start(self):
+        """Start the clock for the time limit"""
+        self._deadline = time() + self.time_limit if self.time_limit is not None else None
+
+    def exhausted(self, stats):
+        """Return the name of the first limit the given statistics reached,
+        or None if the planner may go on"""
+        if self.max_expansions is not None and stats.expanded_nodes >= self.max_expansions:
+            return 'max_expansions'
+        if self.max_generated_nodes is not None and stats.generated_nodes >= self.max_generated_nodes:
+            return 'max_generated_nodes'
+        if self.max_live_nodes is not None and stats.live_nodes >= self.max_live_nodes:
+            return 'max_live_nodes'
+        if self._deadline is not None and time() >= self._deadline:
+            return 'time_limit'
+        if (self.cancellation is not None and
+                (self.cancellation.poll_interval <= 1 or
+                 stats.expanded_nodes % self.cancellation.poll_interval == 0) and
+                self.cancellation.is_cancelled()):
+            return 'cancelled'
+        return None
+
+
+
+class PlanningStatistics(object):
+    """Counters describing a single run of the planner
+
+    status: PLAN_FOUND, NO_PLAN (the search space is exhausted) or
+            BUDGET_EXHAUSTED (the search stopped early, see exhausted_limit,
+            which is 'cancelled' if the budget's CancellationToken was)
+    live_nodes: nodes currently kept in the planning net
+    irrelevant_actions: actions ignored as they cannot help reaching the goal
+    """
+
+    def __init__(self):
+        self.status = None
+        self.exhausted_limit = None
+        self.expanded_nodes = 0
+        self.generated_nodes = 0
+        self.pruned_nodes = 0
+        self.reopened_nodes = 0
+        self.live_nodes = 0
+        self.irrelevant_actions = 0
+        self.duration = 0
+        # (duration, path cost, suboptimality bound) for every plan found
+        self.plans = []
+
+    def __repr__(self):
+        return '<%s status=%s expanded=%s generated=%s pruned=%s reopened=%s live=%s ' \
+               'irrelevant_actions=%s duration=%.4fs>' % (
+                    self.__class__.__name__, self.status, self.expanded_nodes,
+                    self.generated_nodes, self.pruned_nodes,
+                    self.reopened_nodes, self.live_nodes,
+                    self.irrelevant_actions, self.duration)
+
+    def _budget_exhausted(self, limit, plan_found=False):
+        """Record the limit hit, which is logged as an error unless the
+        search was cancelled or a plan was found already"""
+        if plan_found:
+            _logger.info("Planner stops with a plan found because the budget limit '%s' is hit", limit)
+        elif limit == 'cancelled':
+            _logger.warn("Planner stops because the search was cancelled")
+        else:
+            _logger.error("Planner stops because the budget limit '%s' is hit!", limit)
+        self.status = BUDGET_EXHAUSTED
+        self.exhausted_limit = limit
+
 
 
 class Planner(object):
     """
     The given start_worldstate must contain every condition ever needed
     by an action or condition.
+
+    heuristic: the rgoap.heuristics.Heuristic estimating node distances,
+               defaults to the RelativeDistanceHeuristic
+    budget: the default PlanningBudget for plan(), defaults to 500 expansions
+    context_check_threads: number of threads checking the actions' freeform
+               contexts at the start of planning, 0 checks them one by one,
+               kept until close()
+    prune_irrelevant_actions: whether actions that cannot help reaching the
+               goal are ignored, see _get_relevant_actions()
+    replan_max_growth: factor by which replan() lets the reused search graph
+               grow beyond the search that created it before planning anew,
+               as each replan() walks the whole graph
     """
     # TODO: make ordering of actions possible (e.g. move before lookaround)
 
-    def __init__(self, actions, worldstate, goal):
+    def __init__(self, actions, worldstate, goal, heuristic=None, budget=None):
         self._actions = actions
         self._start_worldstate = worldstate
         self._goal = goal
+        self.heuristic = heuristic if heuristic is not None else RelativeDistanceHeuristic()
+        self.budget = budget if budget is not None else PlanningBudget(max_expansions=500)
+        self.context_check_threads = 0
+        self.prune_irrelevant_actions = True
+        self.replan_max_growth = 2
 
         self.last_goal_node = None
+        self.last_stats = None
+        self._depth_limited = False # set by the iterative deepening search
+        self._search_graph = None # kept for replan()
 
-    def plan(self, start_worldstate=None, goal=None):
+        # index from each condition to the actions with an effect on it
+        self._indexed_actions = frozenset()
+        self._effect_index = {}
+        self._action_order = {}
+        # relevant actions and conditions by goal conditions, see _get_relevance_closure()
+        self._relevance_closures = {}
+        # the actions' costs, see Action.static_cost
+        self._action_costs = {}
+        self._context_check_pool = None # created on first use, see close()
+        self._context_check_pool_threads = 0
+
+    def close(self):
+        """stop the threads checking freeform contexts"""
+        if self._context_check_pool is not None:
+            self._context_check_pool.close()
+            self._context_check_pool = None
+            self._context_check_pool_threads = 0
+
+    def plan(self, start_worldstate=None, goal=None, budget=None, weight=1):
         """Plan ...
         Return the node that matches the given start WorldState and
-        is the start node for a plan reaching the given Goal.
+        is the start node for a plan reaching the given Goal, or None.
+        Whether no plan exists or the PlanningBudget ran out is told by
+        last_stats.status.
+
+        A weight greater than 1 inflates the heuristic distances as in
+        weighted A*, which finds plans faster that may cost up to weight
+        times as much as the best plan. An infinite weight searches greedy
+        best-first. Only searches with weight 1 are kept for replan().
 
         If any parameter is not given the data given at initialisation is used.
         """
-        # store parameters in instance variables
+        checked_actions, goal_node = self._start_planning(start_worldstate, goal)
+        stats = self.last_stats
+        start_time = time()
+        budget = budget if budget is not None else self.budget
+        budget.start()
+
+        child_nodes = _OpenList([goal_node] if goal_node.heuristic_distance != INFINITY else [],
+                                weight)
+        stats.generated_nodes += 1
+        stats.live_nodes += 1
+
+        graph = _SearchGraph(self._goal, self._actions, checked_actions,
+                             self._start_worldstate, goal_node)
+        if weight == 1:
+            self._search_graph = graph
+
+        return self._search(child_nodes, checked_actions, graph, budget, start_time)
+
+    def _search(self, child_nodes, checked_actions, graph, budget, start_time):
+        """A* search loop over the given open list, expanding nodes into the
+        given search graph. Return the start node of a plan or None."""
+        stats = self.last_stats
+        best_path_costs = graph.best_path_costs
+
+        loopcount = 0
+        while len(child_nodes) != 0:
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("nodes (%d): %s", len(child_nodes), child_nodes.nodes())
+
+            current_node = child_nodes.pop()
+            if current_node.path_cost() > self._get_best_path_cost(best_path_costs, current_node):
+                # a cheaper path to this worldstate was found after this node was queued
+                _logger.debug("skipping dominated node: %s", current_node)
+                stats.pruned_nodes += 1
+                continue
+
+            loopcount += 1
+            _logger.info("Planning loop #%s", loopcount)
+            _logger.debug("current node (least cost): %s", current_node)
+            _logger.debug("current node's worldstate: %s", current_node.worldstate)
+
+            if len(current_node.unsatisfied_conditions) == 0:
+                _logger.info("Found plan! Considered nodes: %s; nodes left: %s; pruned nodes: %s",
+                             loopcount, len(child_nodes), stats.pruned_nodes)
+                _logger.info("plan nodes: %s", current_node.parent_nodes_path_list)
+                _logger.info("plan actions: %s", current_node.parent_actions_path_list)
+                current_node.suboptimality_bound = child_nodes.weight
+                stats.status = PLAN_FOUND
+                stats.duration = time() - start_time
+                stats.plans.append((stats.duration, current_node.path_cost(), child_nodes.weight))
+                return current_node
+
+            exhausted_limit = budget.exhausted(stats)
+            if exhausted_limit is not None:
+                stats._budget_exhausted(exhausted_limit)
+                break
+
+            new_child_nodes = self._expand_node(current_node, checked_actions, graph, stats)
+
+            # add new nodes. equally weighted nodes leave the open list in
+            # insertion order, so old nodes are preferred to new nodes
+            for node in new_child_nodes:
+                child_nodes.push(node)
+
+        _logger.warn("No plan found.")
+        if stats.status is None:
+            stats.status = NO_PLAN
+        stats.duration = time() - start_time
+        return None
+
+    def replan(self, start_worldstate=None, goal=None, budget=None):
+        """Plan like plan(), but reuse the search graph of the last search
+        for the same goal and actions, if there is one.
+
+        In regressive planning the path costs of all nodes do not depend on
+        the start worldstate. So after the start worldstate changed, only
+        what depends on it is repaired: the nodes' unsatisfied conditions
+        and heuristic distances are updated, expanded nodes get child nodes
+        for actions that became helpful and lose those for actions whose
+        freeform context fails now. The search then goes on from the nodes
+        not expanded yet.
+
+        Action costs are assumed not to have changed since the last search.
+
+        With heuristics that are not admissible, which the regression
+        semantics make most of them, the plan found may cost more than the
+        one a fresh search finds, as the nodes are expanded in another order,
+        just like a fresh search may miss the cheapest plan. With admissible
+        heuristics both searches find plans of the same cost.
+        """
+        graph = self._search_graph
+        if goal is not None and (graph is None or goal is not graph.goal):
+            graph = None
+        if graph is not None and graph.actions != frozenset(self._actions):
+            graph = None
+        if graph is not None:
+            if graph.initial_size is None:
+                graph.initial_size = len(graph.best_path_costs)
+            elif len(graph.best_path_costs) > self.replan_max_growth * graph.initial_size:
+                _logger.info("Planner's reused search grew too big, planning anew")
+                graph = None
+        if graph is None:
+            _logger.info("Planner has no search to reuse, planning anew")
+            return self.plan(start_worldstate, goal, budget)
+
+        if start_worldstate is not None:
+            self._start_worldstate = start_worldstate
+        stats = PlanningStatistics()
+        self.last_stats = stats
+        checked_actions = self._check_actions(_get_conditions(graph.goal_node.worldstate), stats)
+
+        start_time = time()
+        budget = budget if budget is not None else self.budget
+        budget.start()
+
+        changed_conditions = self._get_changed_conditions(graph.start_worldstate,
+                                                          self._start_worldstate)
+        _logger.info("Planner repairs last search for changed conditions: %s",
+                     changed_conditions)
+        checked_actions_changed = frozenset(checked_actions) != graph.checked_actions
+        graph.start_worldstate = WorldState(self._start_worldstate)
+        graph.checked_actions = frozenset(checked_actions)
+        self.heuristic.setup(checked_actions, self._start_worldstate,
+                             graph.goal_node.worldstate, self._get_action_cost)
+        self.last_goal_node = graph.goal_node
+
+        child_nodes = _OpenList()
+        expanded_nodes = self._repair_search_graph(graph, changed_conditions,
+                                                   checked_actions, checked_actions_changed,
+                                                   child_nodes)
+
+        # generate child nodes for actions that became helpful
+        for (node, conditions) in expanded_nodes:
+            graph.dead_end_parents.discard(node)
+            tried_actions = graph.expanded_nodes[node]
+            new_actions = [action
+                           for action in self._filter_matching_actions(node, checked_actions,
+                                                                       conditions)
+                           if action not in tried_actions]
+            for action in new_actions:
+                child_node = node._create_child_node(action, self._start_worldstate,
+                                                     self.heuristic, self._get_action_cost)
+                stats.generated_nodes += 1
+                if child_node.heuristic_distance != INFINITY:
+                    tried_actions.add(action)
+                else:
+                    graph.dead_end_parents.add(node)
+                if self._update_best_path_cost(graph.best_path_costs, child_node, stats):
+                    node.possible_prev_nodes.append(child_node)
+                    stats.live_nodes += 1
+                    child_nodes.push(child_node)
+
+        return self._search(child_nodes, checked_actions, graph, budget, start_time)
+
+    def _repair_search_graph(self, graph, changed_conditions, checked_actions,
+                             checked_actions_changed, child_nodes):
+        """Update all nodes of the search graph for the changed conditions and
+        push the nodes still to be expanded (and plans found before) to the
+        open list child_nodes.
+
+        Return (node, conditions) for the expanded nodes for which other
+        actions might be helpful now: those with a changed unsatisfied
+        condition, with these conditions, as only actions with an effect on
+        them need to be checked again, and those with child nodes that were
+        dead ends, or all nodes if the checked actions changed, with None to
+        check all actions.
+        """
+        stats = self.last_stats
+        expanded_nodes = []
+        nodes = [graph.goal_node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            stats.live_nodes += 1
+            unsatisfied_conditions = node.unsatisfied_conditions
+            node._update_unsatisfied_conditions(unsatisfied_conditions,
+                                                self._start_worldstate, changed_conditions)
+            expanded = node in graph.expanded_nodes
+            if not expanded or len(node.unsatisfied_conditions) == 0:
+                # only the nodes queued again need their heuristic distance
+                node.heuristic_distance = None
+                node._calc_heuristic_distance_for_node(self.heuristic)
+
+            if not expanded:
+                if node.heuristic_distance != INFINITY:
+                    child_nodes.push(node)
+                continue
+
+            if len(node.unsatisfied_conditions) == 0:
+                child_nodes.push(node) # a plan, though expanded before
+            if checked_actions_changed or node in graph.dead_end_parents:
+                expanded_nodes.append((node, None))
+            else:
+                # an effect's match depends on its own condition only
+                conditions = node.unsatisfied_conditions & changed_conditions
+                if len(conditions) > 0:
+                    expanded_nodes.append((node, conditions))
+
+            valid_child_nodes = []
+            for child_node in node.possible_prev_nodes:
+                if self._is_child_node_valid(node, child_node, changed_conditions,
+                                             checked_actions):
+                    valid_child_nodes.append(child_node)
+                else:
+                    graph.expanded_nodes[node].discard(child_node.action)
+                    self._drop_search_subgraph(graph, child_node)
+            node.possible_prev_nodes = valid_child_nodes
+            nodes.extend(valid_child_nodes)
+        return expanded_nodes
+
+    def _is_child_node_valid(self, node, child_node, changed_conditions, checked_actions):
+        """Return whether the child node would be generated again like this
+        from the given node with the current start worldstate"""
+        action = child_node.action
+        if action not in checked_actions:
+            return False
+        if len(changed_conditions) > 0 and \
+                any(isinstance(effect, VariableEffect) for effect in action._effects):
+            # variable preconditions may depend on the start worldstate
+            worldstatecopy = WorldState(node.worldstate)
+            action.apply_preconditions(worldstatecopy, self._start_worldstate)
+            return worldstatecopy == child_node.worldstate
+        return True
+
+    def _drop_search_subgraph(self, graph, node):
+        """Remove the node and all nodes derived from it from the search
+        graph and the transposition table"""
+        nodes = [node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if self._get_best_path_cost(graph.best_path_costs, node) == node.path_cost():
+                del graph.best_path_costs[node.worldstate]
+            graph.dead_end_parents.discard(node)
+            if graph.expanded_nodes.pop(node, None) is not None:
+                nodes.extend(node.possible_prev_nodes)
+                node.possible_prev_nodes = []
+
+    def _get_changed_conditions(self, old_worldstate, new_worldstate):
+        """Return the conditions whose values differ between the given
+        worldstates, including those set in only one of them"""
+        changed_conditions = old_worldstate.get_unsatisfied_conditions(new_worldstate)
+        changed_conditions.update(set(condition for (condition, _) in old_worldstate.iteritems()) ^
+                                  set(condition for (condition, _) in new_worldstate.iteritems()))
+        return changed_conditions
+
+    def plan_bridge(self, nodes, start_worldstate=None, budget=None):
+        """Search a short plan from the start worldstate into any of the
+        given nodes, e.g. the nodes of a plan whose execution failed, and
+        return the start node of the spliced plan or None.
+
+        The search regresses from all given nodes at once, ordered by the
+        cost of the bridge alone, so the node reached is the one closest to
+        the start worldstate, not necessarily the one on the cheapest plan.
+        The spliced plan continues with the path from the reached node to
+        its goal. Nodes on whose path an action's freeform context fails
+        are not used.
+        """
+        if start_worldstate is not None:
+            self._start_worldstate = start_worldstate
+        stats = PlanningStatistics()
+        self.last_stats = stats
+        # preconditions generated for variable effects are relevant as well
+        target_conditions = set()
+        for node in nodes:
+            target_conditions.update(_get_conditions(node.worldstate))
+        # each failed plan has other conditions, so they are not cached
+        checked_actions = self._check_actions(target_conditions, stats, cache=False)
+
+        start_time = time()
+        budget = budget if budget is not None else self.budget
+        budget.start()
+
+        goal_node = nodes[0]
+        while goal_node.parent is not None:
+            goal_node = goal_node.parent
+        self.heuristic.setup(checked_actions, self._start_worldstate, goal_node.worldstate,
+                             self._get_action_cost)
+        self.last_goal_node = goal_node
+
+        graph = _SearchGraph(None, self._actions, checked_actions,
+                             self._start_worldstate, goal_node)
+        graph.best_path_costs.clear()
+
+        # the bridge starts at copies of the nodes, as if they were goal nodes
+        bridge_roots = {}
+        child_nodes = _OpenList()
+        for node in nodes:
+            if not all(action in checked_actions for action in node.parent_actions_path_list):
+                continue
+            root_node = Node(node.worldstate, None)
+            root_node._calc_unsatisfied_conditions(self._start_worldstate)
+            root_node._calc_heuristic_distance_for_node(self.heuristic)
+            stats.generated_nodes += 1
+            if self._update_best_path_cost(graph.best_path_costs, root_node, stats):
+                stats.live_nodes += 1
+                bridge_roots[root_node] = node
+                child_nodes.push(root_node)
+        _logger.info("Planner searches bridge into %d of %d nodes", len(child_nodes), len(nodes))
+
+        bridge_start_node = self._search(child_nodes, checked_actions, graph, budget, start_time)
+        if bridge_start_node is None:
+            return None
+
+        # splice the bridge onto the node reached
+        bridge_nodes = bridge_start_node.parent_nodes_path_list + [bridge_start_node]
+        node = bridge_roots[bridge_nodes[0]]
+        for bridge_node in bridge_nodes[1:]:
+            child_node = Node(bridge_node.worldstate, bridge_node.action, node,
+                              bridge_node.cost())
+            child_node.unsatisfied_conditions = bridge_node.unsatisfied_conditions
+            child_node.heuristic_distance = bridge_node.heuristic_distance
+            node = child_node
+        node.suboptimality_bound = None
+        return node
+
+    def plan_anytime(self, time_limit, start_worldstate=None, goal=None,
+                     initial_weight=5, weight_step=1, budget=None):
+        """Anytime repairing A* (ARA*): plan until time_limit seconds are
+        over and return the start node of the best plan found, or None.
+
+        The search starts with the heuristic distances inflated by
+        initial_weight, which usually finds a first plan fast. Each time a
+        plan is found the weight is decreased by weight_step and the search
+        goes on with the nodes generated so far, looking for a cheaper plan.
+        Planning stops early when the search with weight 1 is finished.
+        An infinite initial_weight starts with greedy search, which goes on
+        with the suboptimality bound of its first plan as weight.
+
+        The returned node's suboptimality_bound tells how much more
+        expensive than an optimal plan the plan can be. stats.plans lists
+        all plans found.
+
+        budget: a PlanningBudget with further limits, by default only
+                time_limit applies
+        """
+        deadline = time() + time_limit
+        checked_actions, goal_node = self._start_planning(start_worldstate, goal)
+        stats = self.last_stats
+        start_time = time()
+        budget = budget if budget is not None else PlanningBudget()
+        budget.start()
+
+        weight = max(initial_weight, 1)
+        child_nodes = _OpenList([goal_node] if goal_node.heuristic_distance != INFINITY else [],
+                                weight)
+        stats.generated_nodes += 1
+        stats.live_nodes += 1
+        graph = _SearchGraph(self._goal, self._actions, checked_actions,
+                             self._start_worldstate, goal_node)
+        self._search_graph = graph
+        best_path_costs = graph.best_path_costs
+
+        best_node = None
+        while True:
+            # worldstates expanded with the current weight, and nodes that
+            # reached such a worldstate cheaper (to be expanded next round)
+            closed = set()
+            inconsistent_nodes = []
+
+            while len(child_nodes) != 0 and \
+                    (best_node is None or child_nodes.min_priority() < best_node.path_cost()):
+                if time() >= deadline:
+                    # the usual end of an anytime search
+                    stats._budget_exhausted('time_limit', best_node is not None)
+                    break
+                exhausted_limit = budget.exhausted(stats)
+                if exhausted_limit is not None:
+                    stats._budget_exhausted(exhausted_limit, best_node is not None)
+                    break
+
+                current_node = child_nodes.pop()
+                if current_node.path_cost() > self._get_best_path_cost(best_path_costs, current_node):
+                    stats.pruned_nodes += 1
+                    continue
+
+                if len(current_node.unsatisfied_conditions) == 0:
+                    if best_node is None or current_node.path_cost() < best_node.path_cost():
+                        best_node = current_node
+                    continue
+
+                try:
+                    closed.add(current_node.worldstate)
+                except TypeError: # unhashable condition value
+                    pass
+
+                for node in self._expand_node(current_node, checked_actions, graph, stats):
+                    if best_node is not None and node.total_cost() >= best_node.path_cost():
+                        stats.pruned_nodes += 1
+                    elif self._is_closed(closed, node):
+                        inconsistent_nodes.append(node)
+                    else:
+                        child_nodes.push(node)
+
+            if best_node is None:
+                break
+
+            # no node left can lead to a plan cheaper than this lower bound
+            lower_bound = min([node.total_cost() for node in child_nodes.nodes() + inconsistent_nodes]
+                              + [best_node.path_cost()])
+            if lower_bound > 0:
+                bound = min(weight, best_node.path_cost() / float(lower_bound))
+            else:
+                bound = 1
+            if best_node.suboptimality_bound is None or bound < best_node.suboptimality_bound:
+                best_node.suboptimality_bound = bound
+                stats.plans.append((time() - start_time, best_node.path_cost(), bound))
+                _logger.info("Anytime planner found plan with cost %s and suboptimality bound %s",
+                             best_node.path_cost(), bound)
+
+            if weight == 1 or stats.status == BUDGET_EXHAUSTED:
+                break
+            if time() >= deadline:
+                stats._budget_exhausted('time_limit', True)
+                break
+
+            if weight == INFINITY:
+                weight = bound
+            else:
+                weight = max(weight - weight_step, 1)
+            child_nodes.set_weight(weight, inconsistent_nodes)
+
+        if best_node is None:
+            _logger.warn("No plan found.")
+            if stats.status is None:
+                stats.status = NO_PLAN
+        else:
+            _logger.info("plan actions: %s", best_node.parent_actions_path_list)
+            stats.status = PLAN_FOUND
+        stats.duration = time() - start_time
+        return best_node
+
+    def plan_iterative_deepening(self, max_depth=30, max_table_size=10000,
+                                 start_worldstate=None, goal=None, budget=None):
+        """Iterative deepening A* (IDA*): plan with memory bounded by the
+        plan length and return the start node of the plan found, or None.
+
+        Instead of keeping every generated node in an open list, depth-first
+        searches are repeated with an increasing limit on the nodes' total
+        cost. Only the nodes on the current path and their siblings are kept,
+        when the search backtracks a node's possible_prev_nodes are dropped.
+        The nodes of the plan found are linked like those from plan().
+
+        max_depth: maximum number of actions in a plan, which bounds the
+                   number of nodes kept to max_depth times the number of
+                   helpful actions per node
+        max_table_size: number of worldstates remembered per iteration to
+                        not search below the same worldstate twice
+        budget: the PlanningBudget, defaults to 10000 expansions as nodes
+                are expanded again in every iteration
+
+        If no plan was found but max_depth cut off the search, the status
+        is BUDGET_EXHAUSTED with the exhausted limit 'max_depth'.
+        """
+        checked_actions, goal_node = self._start_planning(start_worldstate, goal)
+        stats = self.last_stats
+        start_time = time()
+        budget = budget if budget is not None else PlanningBudget(max_expansions=10000)
+        budget.start()
+        stats.generated_nodes += 1
+        stats.live_nodes += 1
+        self._depth_limited = False
+
+        start_node = None
+        threshold = goal_node.total_cost()
+        while start_node is None and threshold != INFINITY:
+            _logger.info("Planning iteration with total cost threshold %s", threshold)
+            # transposition table: (path cost, depth) for worldstates searched in this iteration
+            searched_worldstates = _BoundedTable(max_table_size)
+            start_node, threshold = self._search_depth_first(goal_node, threshold, max_depth,
+                                                             [goal_node.worldstate],
+                                                             searched_worldstates,
+                                                             checked_actions, budget)
+
+        stats.duration = time() - start_time
+        if start_node is None:
+            _logger.warn("No plan found.")
+            if stats.status is None:
+                if self._depth_limited:
+                    stats.status = BUDGET_EXHAUSTED
+                    stats.exhausted_limit = 'max_depth'
+                else:
+                    stats.status = NO_PLAN
+            return None
+
+        _logger.info("plan actions: %s", start_node.parent_actions_path_list)
+        start_node.suboptimality_bound = 1
+        stats.status = PLAN_FOUND
+        stats.plans.append((stats.duration, start_node.path_cost(), 1))
+        return start_node
+
+    def _search_depth_first(self, node, threshold, max_depth, path_worldstates,
+                            searched_worldstates, checked_actions, budget):
+        """Search below the node for a plan within the total cost threshold.
+
+        Return the plan's start node and its total cost, or None and the
+        least total cost that exceeded the threshold (INFINITY if none did).
+        path_worldstates holds the worldstates between the goal and the node,
+        searched_worldstates the path cost and remaining depth for worldstates
+        that were searched below already.
+        """
+        stats = self.last_stats
+        total_cost = node.total_cost()
+        if total_cost > threshold:
+            return None, total_cost
+        if len(node.unsatisfied_conditions) == 0:
+            return node, total_cost
+        if stats.status == BUDGET_EXHAUSTED:
+            return None, INFINITY
+        if max_depth == 0:
+            self._depth_limited = True
+            return None, INFINITY
+        exhausted_limit = budget.exhausted(stats)
+        if exhausted_limit is not None:
+            stats._budget_exhausted(exhausted_limit)
+            return None, INFINITY
+
+        helpful_actions = self._filter_matching_actions(node, checked_actions)
+        child_nodes = node.get_child_nodes(helpful_actions,
+                                           self._start_worldstate,
+                                           self.heuristic,
+                                           self._get_action_cost)
+        stats.expanded_nodes += 1
+        stats.generated_nodes += len(child_nodes)
+        stats.live_nodes += len(child_nodes)
+
+        next_threshold = INFINITY
+        for child_node in sorted(child_nodes, key=Node.total_cost):
+            if child_node.heuristic_distance == INFINITY or \
+                    child_node.worldstate in path_worldstates: # dead end or cycle
+                stats.pruned_nodes += 1
+                continue
+            searched = searched_worldstates.get(child_node.worldstate)
+            if searched is not None and searched[0] <= child_node.path_cost() \
+                    and searched[1] >= max_depth - 1:
+                # searched already with at least as much cost and depth left
+                stats.pruned_nodes += 1
+                continue
+            searched_worldstates.put(child_node.worldstate, (child_node.path_cost(), max_depth - 1))
+            path_worldstates.append(child_node.worldstate)
+            start_node, child_threshold = self._search_depth_first(child_node, threshold,
+                                                                   max_depth - 1,
+                                                                   path_worldstates,
+                                                                   searched_worldstates,
+                                                                   checked_actions,
+                                                                   budget)
+            path_worldstates.pop()
+            if start_node is not None:
+                stats.live_nodes -= len(child_nodes) - 1
+                node.possible_prev_nodes = [child_node]
+                return start_node, child_threshold
+            next_threshold = min(next_threshold, child_threshold)
+
+        # forget the subtree, it is generated again in the next iteration
+        stats.live_nodes -= len(child_nodes)
+        node.possible_prev_nodes = []
+        return None, next_threshold
+
+    def regress_plan(self, actions, start_worldstate=None, goal=None):
+        """Build the nodes for executing the given actions in this order
+        (unlike parent_actions_path_list, which begins at the goal) by
+        regressing from the goal, as plan() does. Return the start node if
+        the plan is valid from the start worldstate, otherwise None.
+
+        This is used to reuse plans found before. The nodes' heuristic
+        distances are set to their exact path cost to the start node.
+        """
         if start_worldstate is not None:
             self._start_worldstate = start_worldstate
         if goal is not None:
             self._goal = goal
 
-        # check input
-        checked_actions = set()
-        for action in self._actions:
-            if not action.check_freeform_context():
-                _logger.warn("Ignoring action with bad freeform context: %s", action)
-            else:
-                checked_actions.add(action)
+        for action in actions:
+            if not action.is_freeform_context_valid():
+                _logger.info("Plan invalid, action with bad freeform context: %s", action)
+                return None
+        self._reset_action_costs()
+
+        goal_worldstate = WorldState()
+        self._goal.apply_preconditions(goal_worldstate)
+        goal_node = Node(goal_worldstate, None)
+        goal_node._calc_unsatisfied_conditions(self._start_worldstate)
+
+        node = goal_node
+        for action in reversed(actions):
+            worldstatecopy = WorldState(node.worldstate)
+            worldstatecopy.record_changes()
+            action.apply_preconditions(worldstatecopy, self._start_worldstate)
+            child_node = Node(worldstatecopy, action, node, self._get_action_cost(action))
+            child_node._calc_unsatisfied_conditions(self._start_worldstate,
+                                                    worldstatecopy.pop_changes())
+            node.possible_prev_nodes = [child_node]
+            node = child_node
+        start_node = node
+
+        if len(start_node.unsatisfied_conditions) != 0:
+            _logger.info("Plan invalid, start worldstate does not match: %s",
+                         start_node.unsatisfied_conditions)
+            return None
+
+        while node is not None:
+            node.heuristic_distance = start_node.path_cost() - node.path_cost()
+            node = node.parent
+
+        stats = PlanningStatistics()
+        stats.status = PLAN_FOUND
+        stats.generated_nodes = stats.live_nodes = len(actions) + 1
+        # the last search is kept for replan(), which checks its goal itself
+        stats.plans.append((0, start_node.path_cost(), None))
+        self.last_stats = stats
+        self.last_goal_node = goal_node
+        return start_node
+
+    def _start_planning(self, start_worldstate, goal):
+        """Store the parameters, reset the statistics, set up the heuristic
+        and return the checked actions and the goal node."""
+        # store parameters in instance variables
+        if start_worldstate is not None:
+            self._start_worldstate = start_worldstate
+        if goal is not None:
+            self._goal = goal
 
         _logger.info("Planner started\n""actions: %s\n"
                      "start_worldstate: %s\n""goal: %s",
                      self._actions, self._start_worldstate, self._goal)
 
+        self.last_stats = PlanningStatistics()
+        self._search_graph = None
+
         # setup goal and loop variables
         goal_worldstate = WorldState()
         self._goal.apply_preconditions(goal_worldstate)
         _logger.debug("goal_worldstate: %s", goal_worldstate)
 
-        goal_node = Node(goal_worldstate, None, [], [])
-        goal_node._calc_heuristic_distance_for_node(self._start_worldstate)
+        checked_actions = self._check_actions(_get_conditions(goal_worldstate), self.last_stats)
+
+        self.heuristic.setup(checked_actions, self._start_worldstate, goal_worldstate,
+                             self._get_action_cost)
+
+        goal_node = Node(goal_worldstate, None)
+        goal_node._calc_unsatisfied_conditions(self._start_worldstate)
+        goal_node._calc_heuristic_distance_for_node(self.heuristic)
         _logger.debug("goal_node: %s", goal_node)
         self.last_goal_node = goal_node
 
-        child_nodes = deque([goal_node])
+        return checked_actions, goal_node
 
-        loopcount = 0
-        while len(child_nodes) != 0:
-            loopcount += 1
-            if loopcount > 500: # loop limit
-                _logger.error("Planner stops because the loop limit (%d) is hit!", loopcount - 1)
-                break
+    def _check_actions(self, goal_conditions, stats, cache=True):
+        """Update the effect index and return the set of actions that are
+        relevant for the given goal conditions and whose freeform context
+        is valid. The number of irrelevant actions is told to the stats.
+        Without cache the relevant actions are not remembered, e.g. for
+        conditions not to be asked for again."""
+        self._update_effect_index()
+        self._reset_action_costs()
 
-            _logger.info("Planning loop #%s", loopcount)
-            _logger.debug("nodes (%d): %s", len(child_nodes), child_nodes)
+        if self.prune_irrelevant_actions:
+            relevant_actions = self._get_relevant_actions(goal_conditions, cache)
+        else:
+            relevant_actions = self._indexed_actions
+        stats.irrelevant_actions = len(self._indexed_actions) - len(relevant_actions)
+        _logger.info("Planner ignores %d irrelevant actions", stats.irrelevant_actions)
 
-            current_node = child_nodes.popleft()
-            _logger.debug("current node (least cost): %s", current_node)
-            _logger.debug("current node's worldstate: %s", current_node.worldstate)
+        checked_actions = check_freeform_contexts(relevant_actions,
+                                                  self._get_context_check_pool())
+        if _logger.isEnabledFor(logging.WARN):
+            for action in relevant_actions:
+                if action not in checked_actions:
+                    _logger.warn("Ignoring action with bad freeform context: %s", action)
+        return checked_actions
 
-            if self._start_worldstate.matches(current_node.worldstate):
-                _logger.info("Found plan! Considered nodes: %s; nodes left: %s", loopcount, len(child_nodes))
-                _logger.info("plan nodes: %s", current_node.parent_nodes_path_list)
-                _logger.info("plan actions: %s", current_node.parent_actions_path_list)
-                return current_node
+    def _get_context_check_pool(self):
+        """Return the ThreadPool checking freeform contexts or None, created
+        anew only when context_check_threads changed"""
+        if self._context_check_pool_threads != self.context_check_threads:
+            self.close()
+        if self._context_check_pool is None and self.context_check_threads > 0:
+            self._context_check_pool = ThreadPool(self.context_check_threads)
+            self._context_check_pool_threads = self.context_check_threads
+        return self._context_check_pool
 
-            helpful_actions = self._filter_matching_actions(current_node.worldstate,
-                                                            checked_actions)
-            new_child_nodes = current_node.get_child_nodes(helpful_actions,
-                                                           self._start_worldstate)
-            _logger.debug("new child nodes: %s", new_child_nodes)
+    def get_relevant_conditions(self, goal):
+        """Return the set of conditions that can matter when planning for
+        the given goal: the goal's conditions and the preconditions' ones of
+        the actions relevant for it, see _get_relevant_actions(). Without
+        prune_irrelevant_actions all known conditions can matter."""
+        if not self.prune_irrelevant_actions:
+            return set(Condition._conditions_dict.values())
+        self._update_effect_index()
+        return self._get_relevance_closure(
+                    [precondition._condition for precondition in goal._preconditions])[1]
 
-            # add new nodes and sort. this is stable, so old nodes stay
-            # more left in the deque than new nodes with same weight
-            child_nodes.extend(new_child_nodes)
-            child_nodes = deque(sorted(child_nodes, key=lambda node: node.total_cost()))
+    def _get_relevant_actions(self, goal_conditions, cache=True):
+        """Return the set of actions that can contribute to reaching the
+        given conditions through any chain of effects and preconditions.
 
-        _logger.warn("No plan found.")
-        return None
+        Preconditions generated for variable effects are unknown in advance.
+        They are assumed to concern the effect's condition only if the action
+        tells so by variable_preconditions_on_effects_only, otherwise all
+        actions and conditions are relevant once the action is.
+        """
+        return self._get_relevance_closure(goal_conditions, cache)[0]
+
+    def _get_relevance_closure(self, goal_conditions, cache=True):
+        """Return the sets of relevant actions and of relevant conditions for
+        the given goal conditions, cached until the actions change"""
+        goal_conditions = frozenset(goal_conditions)
+        closure = self._relevance_closures.get(goal_conditions)
+        if closure is None:
+            closure = self._find_relevance_closure(goal_conditions)
+            if cache:
+                self._relevance_closures[goal_conditions] = closure
+        return closure
+
+    def _find_relevance_closure(self, goal_conditions):
+        """Return the closure for the given frozenset of goal conditions,
+        see _get_relevance_closure()"""
+        relevant_actions = set()
+        relevant_conditions = set(goal_conditions)
+        open_conditions = list(goal_conditions)
+        while len(open_conditions) > 0:
+            condition = open_conditions.pop()
+            for action in self._effect_index.get(condition, ()):
+                if action in relevant_actions:
+                    continue
+                relevant_actions.add(action)
+                if not action.variable_preconditions_on_effects_only and \
+                        any(isinstance(effect, VariableEffect) for effect in action._effects):
+                    # any condition can become one of its preconditions
+                    return (set(self._indexed_actions),
+                            set(Condition._conditions_dict.values()) | goal_conditions)
+                for precondition in action._preconditions:
+                    if precondition._condition not in relevant_conditions:
+                        relevant_conditions.add(precondition._condition)
+                        open_conditions.append(precondition._condition)
+
+        return (relevant_actions, relevant_conditions)
+
+    def _reset_action_costs(self):
+        """Forget the costs of actions without static_cost, which are asked
+        once per planning run"""
+        self._action_costs = dict((action, cost)
+                                  for (action, cost) in self._action_costs.iteritems()
+                                  if action.static_cost)
+
+    def _get_action_cost(self, action):
+        try:
+            return self._action_costs[action]
+        except KeyError:
+            cost = self._action_costs[action] = action.cost()
+            return cost
+
+    def _expand_node(self, node, checked_actions, graph, stats):
+        """Generate the node's child nodes and return those that are
+        neither dead ends nor reach a known worldstate at higher cost."""
+        helpful_actions = self._filter_matching_actions(node, checked_actions)
+        new_child_nodes = node.get_child_nodes(helpful_actions,
+                                               self._start_worldstate,
+                                               self.heuristic,
+                                               self._get_action_cost)
+        stats.expanded_nodes += 1
+        stats.generated_nodes += len(new_child_nodes)
+        _logger.debug("new child nodes: %s", new_child_nodes)
+
+        # actions whose child nodes need not be generated again by replan()
+        tried_actions = set(child.action for child in new_child_nodes
+                            if child.heuristic_distance != INFINITY)
+        graph.expanded_nodes[node] = tried_actions
+        if len(tried_actions) < len(new_child_nodes):
+            graph.dead_end_parents.add(node)
+
+        # drop nodes whose worldstate is already reached at least as cheap
+        new_child_nodes = [child for child in new_child_nodes
+                           if self._update_best_path_cost(graph.best_path_costs, child, stats)]
+        node.possible_prev_nodes = new_child_nodes
+        stats.live_nodes += len(new_child_nodes)
+        return new_child_nodes
+
+    def _is_closed(self, closed, node):
+        try:
+            return node.worldstate in closed
+        except TypeError: # unhashable condition value
+            return False
 
-    def _filter_matching_actions(self, node_worldstate, actions):
+    def _get_best_path_cost(self, best_path_costs, node):
+        """Return the least known path cost to the node's worldstate"""
+        try:
+            return best_path_costs[node.worldstate]
+        except (KeyError, TypeError): # TypeError: unhashable condition value
+            return node.path_cost()
+
+    def _update_best_path_cost(self, best_path_costs, node, stats):
+        """Return False if the node's worldstate is known to be reachable at
+        least as cheap or if the node is a dead end, otherwise store the
+        node's path cost and return True.
+
+        Worldstates that were reached before at higher cost are reopened.
+        """
+        if node.heuristic_distance == INFINITY:
+            _logger.debug("pruning dead end node: %s", node)
+            stats.pruned_nodes += 1
+            return False
+
+        try:
+            best_path_cost = best_path_costs.get(node.worldstate)
+        except TypeError: # unhashable condition value, cannot detect duplicates
+            return True
+
+        path_cost = node.path_cost()
+        if best_path_cost is not None:
+            if best_path_cost <= path_cost:
+                _logger.debug("pruning dominated duplicate node: %s", node)
+                stats.pruned_nodes += 1
+                return False
+            _logger.debug("reopening worldstate at lower cost: %s", node)
+            stats.reopened_nodes += 1
+        best_path_costs[node.worldstate] = path_cost
+        return True
+
+    def _update_effect_index(self):
+        """(Re)build the index from conditions to the actions having an
+        effect on them, if the set of actions changed since the last call.
+        """
+        actions = frozenset(self._actions)
+        if actions == self._indexed_actions:
+            return
+
+        self._indexed_actions = actions
+        self._effect_index = {}
+        self._action_order = {}
+        self._relevance_closures = {}
+        for action in self._actions:
+            self._action_order[action] = len(self._action_order)
+            for effect in action._effects:
+                bucket = self._effect_index.setdefault(effect._condition, [])
+                if action not in bucket:
+                    bucket.append(action)
+        _logger.debug("Planner indexed %d actions by %d conditions",
+                      len(actions), len(self._effect_index))
+
+    def _filter_matching_actions(self, node, actions, conditions=None):
         """Returns a list of actions that might help between
-        start_worldstate and current node_worldstate.
+        start_worldstate and the given node's worldstate.
+
+        Only actions with an effect on an unsatisfied condition are checked,
+        or on one of the given unsatisfied conditions.
         """
-        # check which conditions differ between start and current node
-        unsatisfied_conditions_set = node_worldstate.get_unsatisfied_conditions(self._start_worldstate)
+        node_worldstate = node.worldstate
+        unsatisfied_conditions_set = node.unsatisfied_conditions
+
+        # look up candidate actions, keeping the order of the action set
+        candidate_actions = set()
+        for condition in (conditions if conditions is not None else unsatisfied_conditions_set):
+            candidate_actions.update(self._effect_index.get(condition, ()))
+        candidate_actions = sorted(candidate_actions.intersection(actions),
+                                   key=self._action_order.__getitem__)
 
         helpful_actions = []
         # check which action might satisfy those conditions
-        for action in actions:
+        for action in candidate_actions:
             if action.has_satisfying_effects(node_worldstate, self._start_worldstate, unsatisfied_conditions_set):
                 _logger.debug("helping action: %s", action)
                 helpful_actions.append(action)
@@ -274,8 +1403,6 @@ class PlanExecutor(object):
 
     def execute(self, start_node, introspector=None):
         """Execute an RGOAP plan, return True on success, False otherwise"""
-        assert len(start_node.parent_nodes_path_list) == len(start_node.parent_actions_path_list)
-
         if start_node.is_goal():
             _logger.info("Executor reached goal node, stopping execution")
             return True
@@ -289,7 +1416,7 @@ class PlanExecutor(object):
             introspector.publish_update(start_node)
 
         if action.is_valid(current_worldstate):
-            if action.check_freeform_context():
+            if action.is_freeform_context_valid():
                 _logger.info("PlanExecutor now executes: %s", action)
                 action.run(next_worldstate)
 #                _logger.info("Memory is now: %s", action._memory   # only for mem actions)
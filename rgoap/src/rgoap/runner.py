@@ -33,13 +33,17 @@
 
 import roslib; roslib.load_manifest('goap')
 
+from copy import copy
+from threading import Lock
 from time import sleep
 
 import rgoap
 
-from common import Condition, WorldState, stringify, stringify_dict
+from common import Condition, ConditionPoller, WorldState, stringify, stringify_dict
 from memory import Memory
-from planning import Planner, PlanExecutor
+from planning import Planner, PlanExecutor, CancellationToken
+from plancache import PlanCache, PlanStore
+from parallel import CompiledDomain, PlanningPool, plan_goals_in_parallel
 
 
 import logging
@@ -53,14 +57,46 @@ class Runner(object):
     self.worldstate: the default/start worldstate
     self.actions: the actions this runner uses
     self.planner: the planner this runner uses
+    self.plan_cache: the PlanCache this runner uses, or None
+    self.plan_store: the PlanStore this runner uses, or None
+    self.cancellation: the CancellationToken polled by the planner, which
+        cancels a search when preemption is requested or on shutdown
+    self.worldstate_version: counter increased whenever an update changes the
+        worldstate, see worldstate_changed_since()
     """
 
-    def __init__(self, config_module=None):
+    def __init__(self, config_module=None, plan_cache_size=0, plan_store_path=None,
+                 incremental_replanning=False, plan_repair_budget=None,
+                 goal_planning_processes=0, context_check_threads=0,
+                 goal_relevant_polling=False, polling_threads=0, polling_timeout=None,
+                 push_updates=False):
         """
         param:config_module: a scenario/robot specific module to prepare setup,
                 that has the following members:
                     get_all_conditions() -> return a list of conditions
                     get_all_actions() -> return a list of actions
+        param:plan_cache_size: number of plans to cache for reuse, 0 disables the cache
+        param:plan_store_path: SQLite database file to keep plans in across restarts,
+                None disables the store
+        param:incremental_replanning: let the planner repair its last search instead of
+                planning anew when planning for the same goal again, see Planner.replan()
+        param:plan_repair_budget: PlanningBudget for bridging into a failed plan before
+                replanning, see repair_plan(), None disables plan repair
+        param:goal_planning_processes: number of worker processes planning for all goals
+                at once in plan_and_execute_goals(), 0 plans for one goal after another,
+                kept until close()
+        param:context_check_threads: number of threads checking the actions' freeform
+                contexts at the start of planning, 0 checks them one by one
+        param:goal_relevant_polling: update only the conditions relevant for the goals
+                planned for, see Planner.get_relevant_conditions(), leaving the
+                values of the other conditions outdated
+        param:polling_threads: number of threads polling the conditions when updating the
+                worldstate, 0 polls them one by one, kept until close(),
+                see ConditionPoller
+        param:polling_timeout: seconds after which a condition polled in a thread keeps
+                its last known value and is marked stale, None waits for all
+        param:push_updates: poll conditions pushing their values, see
+                Condition.pushes_values, only after they notified a change
         """
         self.memory = Memory()
         self.worldstate = WorldState()
@@ -72,7 +108,27 @@ class Runner(object):
             for action in config_module.get_all_actions(self.memory):
                 self.actions.add(action)
 
+        self.cancellation = CancellationToken([self.preempt_requested,
+                                               lambda: rgoap.is_shutdown()])
         self.planner = Planner(self.actions, self.worldstate, None)
+        self.planner.budget.cancellation = self.cancellation
+        self.planner.context_check_threads = context_check_threads
+        self.goal_relevant_polling = goal_relevant_polling
+        self.polling_threads = polling_threads
+        self.polling_timeout = polling_timeout
+        self._condition_poller = None # created on first use, see close()
+        self.push_updates = push_updates
+        self.worldstate_version = 0
+        self._condition_versions = {}
+        self._observed_conditions = set()
+        self._dirty_conditions = set()
+        self._dirty_conditions_lock = Lock()
+        self.plan_cache = PlanCache(plan_cache_size) if plan_cache_size > 0 else None
+        self.plan_store = PlanStore(plan_store_path) if plan_store_path is not None else None
+        self.incremental_replanning = incremental_replanning
+        self.plan_repair_budget = plan_repair_budget
+        self.goal_planning_processes = goal_planning_processes
+        self._planning_pool = None # created on first use, see close()
 
         self._last_goal = None
         self._preempt_requested = False # preemption mechanism
@@ -92,45 +148,184 @@ class Runner(object):
     def service_preempt(self):
         self._preempt_requested = False
 
-
-    def _update_worldstate(self):
-        """update worldstate to reality"""
-        Condition.initialize_worldstate(self.worldstate)
-        _logger.info("worldstate initialized/updated to: %s", self.worldstate)
+    def close(self):
+        """stop the worker processes planning for goals and the threads
+        polling conditions or checking contexts and close the plan store"""
+        self.planner.close()
+        if self._planning_pool is not None:
+            self._planning_pool.close()
+            self._planning_pool = None
+        if self._condition_poller is not None:
+            self._condition_poller.close()
+            self._condition_poller = None
+        if self.plan_store is not None:
+            self.plan_store.close()
+
+
+    def _update_worldstate(self, *goals):
+        """update worldstate to reality, only the conditions relevant for
+        the given goals if goal_relevant_polling is set"""
+        if self.goal_relevant_polling and len(goals) > 0:
+            conditions = set()
+            for goal in goals:
+                conditions.update(self.planner.get_relevant_conditions(goal))
+        else:
+            conditions = Condition._conditions_dict.values()
+        if self.push_updates:
+            conditions = self._get_dirty_conditions(conditions)
+
+        if self.polling_threads > 0 and self._condition_poller is None:
+            self._condition_poller = ConditionPoller(self.polling_threads,
+                                                     self.polling_timeout)
+
+        self.worldstate.record_changes()
+        try:
+            stale_conditions = Condition.update_worldstate(self.worldstate, conditions,
+                                                           self._condition_poller)
+        finally:
+            changes = self.worldstate.pop_changes()
+        if len(changes) > 0:
+            self.worldstate_version += 1
+            for condition in changes:
+                self._condition_versions[condition] = self.worldstate_version
+        _logger.info("worldstate updated %d polled conditions, version %d: %s",
+                     len(conditions), self.worldstate_version, self.worldstate)
+
+        if len(stale_conditions) > 0:
+            _logger.warn("worldstate has stale values for: %s", stringify(stale_conditions))
+            if self.push_updates:
+                # poll them again next time
+                for condition in stale_conditions:
+                    if condition in self._observed_conditions:
+                        self._mark_dirty(condition)
+
+    def _get_dirty_conditions(self, conditions):
+        """return the given conditions without those pushing their values
+        that did not notify a change since they were polled last, starting
+        to observe the ones not observed yet"""
+        dirty_conditions = []
+        with self._dirty_conditions_lock:
+            for condition in conditions:
+                if not condition.pushes_values:
+                    dirty_conditions.append(condition)
+                elif condition not in self._observed_conditions:
+                    condition.add_observer(self._mark_dirty)
+                    self._observed_conditions.add(condition)
+                    dirty_conditions.append(condition)
+                elif condition in self._dirty_conditions:
+                    self._dirty_conditions.remove(condition)
+                    dirty_conditions.append(condition)
+        return dirty_conditions
+
+    def _mark_dirty(self, condition):
+        """observer of the conditions pushing their values"""
+        with self._dirty_conditions_lock:
+            self._dirty_conditions.add(condition)
+
+    def worldstate_changed_since(self, version, conditions=None):
+        """return whether any value in the worldstate, or of the given
+        conditions only, changed since the given worldstate_version"""
+        if conditions is None:
+            return self.worldstate_version > version
+        return any(self._condition_versions.get(condition, 0) > version
+                   for condition in conditions)
 
     def _check_conditions(self):
         # check for any still uninitialised condition
-        for (condition, value) in self.worldstate._condition_values.iteritems():
+        for (condition, value) in self.worldstate.iteritems():
             if value is None:
                 _logger.warn("Condition still 'None': %s", condition)
 
 
-    def update_and_plan(self, goal, tries=1, introspection=False):
+    def update_and_plan(self, goal, tries=1, introspection=False, budget=None):
         """update worldstate and call self.plan(...), repeating for
-        number of tries or until a plan is found"""
+        number of tries or until a plan is found
+
+        budget: the PlanningBudget for each try, see Planner.plan()"""
         assert tries >= 1
         while tries > 0:
             tries -= 1
-            self._update_worldstate()
-            start_node = self.plan(goal, introspection)
-            if start_node is not None:
+            self._update_worldstate(goal)
+            start_node = self.plan(goal, introspection, budget)
+            if start_node is not None or self._planning_cancelled():
                 break
             if tries > 0: # if there are tries left
                 _logger.warn("Runner retrying in update_and_plan")
         return start_node
 
 
-    def plan(self, goal, introspection=False):
-        """plan for given goal and return start_node of plan or None"""
+    def plan(self, goal, introspection=False, budget=None):
+        """plan for given goal and return start_node of plan or None,
+        self.planner.last_stats.status tells why no plan was returned"""
         self._check_conditions()
-        return self.planner.plan(goal=goal)
+        start_node = self._reuse_plan(goal)
+        if start_node is not None:
+            return start_node
+
+        budget = self._cancellable(budget)
+        if self.incremental_replanning:
+            start_node = self.planner.replan(goal=goal, budget=budget)
+        else:
+            start_node = self.planner.plan(goal=goal, budget=budget)
+
+        if start_node is not None:
+            if self.plan_cache is not None:
+                self.plan_cache.put(goal, start_node, self.actions)
+            if self.plan_store is not None:
+                self.plan_store.put(goal, start_node, self.actions)
+        return start_node
+
+    def _cancellable(self, budget):
+        """return the given PlanningBudget, or a copy polling this runner's
+        cancellation token if it has no token of its own"""
+        if budget is None or budget.cancellation is not None:
+            return budget
+        budget = copy(budget)
+        budget.cancellation = self.cancellation
+        return budget
+
+    def _planning_cancelled(self):
+        stats = self.planner.last_stats
+        return stats is not None and stats.exhausted_limit == 'cancelled'
+
+    def _reuse_plan(self, goal):
+        """return start_node of a cached or stored plan for the given goal
+        that is valid in the current worldstate, or None"""
+        if self.plan_cache is not None:
+            start_node = self.plan_cache.get(self.planner, goal, self.worldstate, self.actions)
+            if start_node is not None:
+                return start_node
+        if self.plan_store is not None:
+            start_node = self.plan_store.get(self.planner, goal, self.worldstate, self.actions)
+            if start_node is not None:
+                if self.plan_cache is not None:
+                    self.plan_cache.put(goal, start_node, self.actions)
+                return start_node
+        return None
+
 
 
+    def repair_plan(self, failed_start_node):
+        """search a short plan from the current worldstate into any node of
+        the failed plan and return the new start_node, or None if plan repair
+        is disabled or failed"""
+        if self.plan_repair_budget is None:
+            return None
+        self._check_conditions()
+        nodes = [failed_start_node] + failed_start_node.parent_nodes_path_list
+        start_node = self.planner.plan_bridge(nodes,
+                                              budget=self._cancellable(self.plan_repair_budget))
+        if start_node is None:
+            _logger.info("Plan repair failed: %s", self.planner.last_stats)
+        else:
+            _logger.info("Plan repaired: %s", self.planner.last_stats)
+        return start_node
+
 
     def plan_and_execute_goals(self, goals):
         """Sort goals by usability and try to plan and execute one by one until
         one goal is achieved"""
-        self._update_worldstate()
+        self._update_worldstate(*goals)
 
         # sort goals
         goals.sort(key=lambda goal: goal.usability, reverse=True)
@@ -139,19 +334,7 @@ class Runner(object):
             _logger.info("Available goals:\n%s", stringify(goals, '\n'))
 
         # plan until plan for one goal found
-        for goal in goals:
-            # skip goal we used last time
-            if self._last_goal is goal:
-                continue
-
-            if self.preempt_requested():
-                self.service_preempt()
-                return 'preempted'
-
-            plan = self.plan(goal)
-            if plan is None:
-                continue # try next goal
-
+        for (goal, plan) in self._plan_goals(goals):
             # execution
             self._last_goal = goal
             _logger.info("Executing most usable goal: %s", goal)
@@ -164,26 +347,79 @@ class Runner(object):
 
             return outcome
 
+        if self.preempt_requested():
+            self.service_preempt()
+            return 'preempted'
+
         _logger.error("For no goal a plan could be found!")
         outcome = 'aborted'
 
         return outcome
 
 
+    def _plan_goals(self, goals):
+        """yield (goal, start_node) for the given goals in their order,
+        skipping goals without a plan and stopping when preempted"""
+        # skip goal we used last time
+        goals = [goal for goal in goals if goal is not self._last_goal]
+
+        if self.goal_planning_processes > 0 and len(goals) > 1:
+            self._check_conditions()
+            actions = list(self.actions)
+            try:
+                domain = CompiledDomain(actions, self.worldstate, goals)
+            except ValueError as e:
+                _logger.warn("Planning for one goal after another: %s", e)
+            else:
+                if self._planning_pool is None:
+                    self._planning_pool = PlanningPool(self.goal_planning_processes)
+                result = plan_goals_in_parallel(domain, self.planner.heuristic.__class__,
+                                                preempt_requested=self.preempt_requested,
+                                                pool=self._planning_pool)
+                if result is None:
+                    return
+                (goal_index, action_indices, _) = result
+                goal = goals[goal_index]
+                plan = self.planner.regress_plan([actions[index] for index in action_indices],
+                                                 self.worldstate, goal)
+                if plan is not None:
+                    yield (goal, plan)
+                # plan anew for the goals after it, whose searches were cancelled
+                goals = goals[goal_index + 1:]
+
+        for goal in goals:
+            if self.preempt_requested():
+                return
+            plan = self.plan(goal)
+            if plan is not None:
+                yield (goal, plan)
+
+
     def update_and_plan_and_execute(self, goal, tries=1, introspection=False):
         """loop that updates, plans and executes until the goal is reached"""
         outcome = None
+        failed_start_node = None
         # replan and retry on failure as long as a plan is found
         while not rgoap.is_shutdown():
             if self.preempt_requested():
                 self.service_preempt()
                 return 'preempted'
 
-            start_node = self.update_and_plan(goal, tries, introspection)
+            start_node = None
+            if failed_start_node is not None:
+                # worldstate was updated after the failure
+                start_node = self.repair_plan(failed_start_node)
+            if start_node is None:
+                start_node = self.update_and_plan(goal, tries, introspection)
+
+            if start_node is None and self.preempt_requested():
+                self.service_preempt()
+                return 'preempted'
 
             if start_node is None:
                 # TODO: maybe at this point update and replan, regardless of 'tries'? reality might have changed
-                _logger.error("RGOAP Runner aborts, no plan found!")
+                _logger.error("RGOAP Runner aborts, no plan found! (%s)",
+                              self.planner.last_stats.status)
                 return 'aborted'
 
             outcome = self.execute(start_node, introspection)
@@ -194,11 +430,12 @@ class Runner(object):
             # check failure
             _logger.warn("RGOAP Runner execution fails, replanning..")
 
-            self._update_worldstate()
+            self._update_worldstate(goal)
             if not goal.is_valid(self.worldstate):
                 _logger.warn("Goal isn't valid in current worldstate")
             else:
                 _logger.error("Though goal is valid in current worldstate, the plan execution failed!?")
+            failed_start_node = start_node
 
         # until we are succeeding or are preempted
         return outcome
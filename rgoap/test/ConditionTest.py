@@ -30,8 +30,28 @@
 
 
 import unittest
+from threading import Event
+from time import time, sleep
 
-from rgoap.common import Condition
+from rgoap.common import Condition, ConditionPoller, WorldState
+
+
+
+class FixedCondition(Condition):
+
+    def __init__(self, state_name, value, event=None, delay=0):
+        Condition.__init__(self, state_name)
+        self.value = value
+        self.event = event
+        self.delay = delay
+        self.calls = 0
+
+    def get_value(self):
+        self.calls += 1
+        if self.event is not None:
+            self.event.wait()
+        sleep(self.delay)
+        return self.value
 
 
 class ConditionTest(unittest.TestCase):
@@ -59,10 +79,86 @@ class ConditionTest(unittest.TestCase):
     def testGet(self):
         self.assertRaises(AssertionError, Condition.get, 'name_inexistent') # 'Does not fail on getting inexistent condition')
 
+    def testIndex(self):
+        self.assertEqual(self.condition2._index, self.condition1._index + 1)
+        self.assertIs(Condition._conditions_by_index[self.condition1._index], self.condition1)
+
     def testGetSame(self):
         self.assertIs(Condition.add(self.condition1), None, 'Could not add new condition')
         self.assertIs(Condition.get('name1'), self.condition1, 'Could not get that same condition')
 
+    def testUpdateWorldstate(self):
+        fast = FixedCondition('fast', 1)
+        other = FixedCondition('other', 2)
+        worldstate = WorldState()
+        self.assertEqual(Condition.update_worldstate(worldstate, [fast]), [])
+        self.assertEqual(worldstate.get_condition_value(fast), 1)
+        self.assertRaises(KeyError, worldstate.get_condition_value, other)
+        self.assertIsNotNone(fast.last_latency)
+        poller = ConditionPoller(2)
+        try:
+            self.assertEqual(Condition.update_worldstate(worldstate, [fast, other], poller), [])
+        finally:
+            poller.close()
+        self.assertEqual(worldstate.get_condition_value(other), 2)
+
+    def testPollingTimeout(self):
+        event = Event()
+        slow = FixedCondition('slow', 1)
+        fast = FixedCondition('fast', 1)
+        worldstate = WorldState()
+        Condition.update_worldstate(worldstate, [slow, fast])
+        slow.event = event
+        slow.value = fast.value = 2
+        poller = ConditionPoller(2, timeout=0.05)
+        try:
+            try:
+                start_time = time()
+                stale_conditions = Condition.update_worldstate(worldstate, [slow, fast], poller)
+                self.assertLess(time() - start_time, 1)
+                self.assertEqual(stale_conditions, [slow])
+                self.assertTrue(slow.stale)
+                self.assertFalse(fast.stale)
+                self.assertGreaterEqual(slow.last_latency, 0.05)
+                # the stale condition keeps its last known value
+                self.assertEqual(worldstate.get_condition_value(slow), 1)
+                self.assertEqual(worldstate.get_condition_value(fast), 2)
+                # the hanging call is not started again
+                self.assertEqual(Condition.update_worldstate(worldstate, [slow, fast], poller),
+                                 [slow])
+                self.assertEqual(slow.calls, 2)
+            finally:
+                event.set()
+            sleep(0.01)
+            self.assertEqual(Condition.update_worldstate(worldstate, [slow], poller), [])
+        finally:
+            poller.close()
+        self.assertEqual(slow.calls, 3)
+        self.assertFalse(slow.stale)
+        self.assertEqual(worldstate.get_condition_value(slow), 2)
+
+    def testQueuedPollTimeout(self):
+        conditions = [FixedCondition('queued%d' % i, i, delay=0.06) for i in range(4)]
+        worldstate = WorldState()
+        Condition.update_worldstate(worldstate, conditions)
+        # the second two wait for a thread, their timeouts start with their calls
+        poller = ConditionPoller(2, timeout=0.1)
+        try:
+            self.assertEqual(Condition.update_worldstate(worldstate, conditions, poller), [])
+        finally:
+            poller.close()
+
+    def testFirstPollTimeout(self):
+        slow = FixedCondition('slow', 1, delay=0.05)
+        worldstate = WorldState()
+        poller = ConditionPoller(1, timeout=0.01)
+        try:
+            # without a last known value the first value is waited for
+            self.assertEqual(Condition.update_worldstate(worldstate, [slow], poller), [])
+        finally:
+            poller.close()
+        self.assertEqual(worldstate.get_condition_value(slow), 1)
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import cPickle as pickle
+import unittest
+from time import time
+
+from rgoap.common import Condition, WorldState, Precondition, Goal, VariableEffect
+from rgoap.memory import MemoryCondition, MemoryChangeVarAction, MemorySetVarAction
+from rgoap.heuristics import RelativeDistanceHeuristic
+from rgoap.planning import PlanningBudget
+from rgoap.parallel import CompiledDomain, PlanningPool, plan_goals_in_parallel
+from rgoap.parallel import PlannerPortfolio
+from rgoap.runner import Runner
+
+
+
+def _count_conditions():
+    """run in a worker process"""
+    return len(Condition._conditions_by_index)
+
+
+class ParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        Condition._conditions_dict.clear() # start every test without previous conditions
+        self.runner = Runner(goal_planning_processes=2)
+        self.memory = self.runner.memory
+        for state_name in ['memory.a', 'memory.b']:
+            Condition.add(MemoryCondition(self.memory, state_name, 0))
+            for value in range(3):
+                self.runner.actions.add(MemoryChangeVarAction(self.memory, state_name,
+                                                              value, value + 1))
+        self.actions = list(self.runner.actions)
+        self.worldstate = WorldState()
+        Condition.initialize_worldstate(self.worldstate)
+        # ordered by usability, the first one is unreachable
+        self.goals = [Goal([Precondition(Condition.get('memory.a'), 9)], 1),
+                      Goal([Precondition(Condition.get('memory.b'), 2)], 0.8),
+                      Goal([Precondition(Condition.get('memory.a'), 1)], 0.5)]
+
+    def tearDown(self):
+        self.runner.close()
+
+    def testBuild(self):
+        domain = CompiledDomain(self.actions, self.worldstate, self.goals)
+        (actions, worldstate, goals) = domain.build()
+        self.assertEqual(len(actions), len(self.actions))
+        self.assertEqual(dict((condition._state_name, value)
+                              for (condition, value) in worldstate.iteritems()),
+                         {'memory.a': 0, 'memory.b': 0})
+        self.assertEqual(len(goals), 3)
+        for action in actions:
+            self.assertEqual(action.cost(), self.actions[action.index].cost())
+
+    def testNotCompilable(self):
+        condition = Condition.get('memory.a')
+        self.actions.append(MemorySetVarAction(self.memory, 'memory.a', 5, [],
+                                               [VariableEffect(condition)]))
+        self.assertRaises(ValueError, CompiledDomain, self.actions, self.worldstate, self.goals)
+
+    def testPlanGoalsInParallel(self):
+        domain = CompiledDomain(self.actions, self.worldstate, self.goals)
+        (goal_index, action_indices, stats) = plan_goals_in_parallel(
+                domain, RelativeDistanceHeuristic, processes=2)
+        self.assertEqual(goal_index, 1, 'Most usable reachable goal should win')
+        self.assertEqual([self.actions[index]._new_value for index in action_indices], [1, 2])
+        self.assertEqual(stats.status, 'plan_found')
+
+    def testPlanGoalsInParallelNoPlan(self):
+        domain = CompiledDomain(self.actions, self.worldstate, self.goals[:1])
+        self.assertIsNone(plan_goals_in_parallel(domain, RelativeDistanceHeuristic))
+
+    def testPlanningPool(self):
+        pool = PlanningPool(2)
+        try:
+            for _ in range(2):
+                domain = CompiledDomain(self.actions, self.worldstate, self.goals)
+                (goal_index, _, _) = plan_goals_in_parallel(domain, RelativeDistanceHeuristic,
+                                                            pool=pool)
+                self.assertEqual(goal_index, 1)
+        finally:
+            pool.close()
+
+    def testPlanningPoolConditions(self):
+        pool = PlanningPool(1)
+        try:
+            domain = CompiledDomain(self.actions, self.worldstate, self.goals)
+            plan_goals_in_parallel(domain, RelativeDistanceHeuristic, pool=pool)
+            count = pool._pool.apply(_count_conditions)
+            for _ in range(20):
+                plan_goals_in_parallel(domain, RelativeDistanceHeuristic, pool=pool)
+            # the worker's domains share their compiled conditions
+            self.assertEqual(pool._pool.apply(_count_conditions), count)
+        finally:
+            pool.close()
+        count = _count_conditions()
+        domain.build()
+        domain.build()
+        self.assertLessEqual(_count_conditions(), count + len(domain.start_values))
+
+    def testPlanningPoolCancel(self):
+        # a huge search space without a plan
+        for index in range(6):
+            Condition.add(MemoryCondition(self.memory, 'memory.c%d' % index, 0))
+            for value in range(9):
+                self.actions.append(MemoryChangeVarAction(self.memory, 'memory.c%d' % index,
+                                                          value, value + 1))
+        Condition.initialize_worldstate(self.worldstate)
+        goal = Goal([Precondition(Condition.get('memory.c%d' % index), 5)
+                     for index in range(6)] + [Precondition(Condition.get('memory.a'), 9)])
+        domain = CompiledDomain(self.actions, self.worldstate, [goal])
+        pool = PlanningPool(1)
+        try:
+            result = pool.apply_async(pickle.dumps(domain), 0, RelativeDistanceHeuristic,
+                                      PlanningBudget(max_expansions=10 ** 6))
+            result.wait(0.2)
+            self.assertFalse(result.ready())
+            start_time = time()
+            pool.cancel()
+            self.assertLess(time() - start_time, 5)
+            self.assertEqual(result.get()[1].exhausted_limit, 'cancelled')
+            # the worker is ready for the next search
+            domain = CompiledDomain(self.actions, self.worldstate, self.goals[1:2])
+            self.assertIsNotNone(plan_goals_in_parallel(domain, RelativeDistanceHeuristic,
+                                                        pool=pool))
+        finally:
+            pool.close()
+
+    def testPortfolio(self):
+        portfolio = PlannerPortfolio(self.runner.actions, self.worldstate, self.goals[1])
+        self.addCleanup(portfolio.close)
+        start_node = portfolio.plan()
+        self.assertEqual(len(start_node.parent_actions_path_list), 2)
+        self.assertIn(portfolio.last_winner, portfolio.wins)
+        self.assertEqual(sum(portfolio.wins.values()), 1)
+        self.assertIn(portfolio.last_winner, [name for (name, _) in portfolio.last_results])
+        pool = portfolio._pool
+        self.assertIsNotNone(portfolio.plan())
+        self.assertIs(portfolio._pool, pool, 'Worker processes should be kept')
+
+    def testPortfolioTimeLimit(self):
+        portfolio = PlannerPortfolio(self.runner.actions, self.worldstate, self.goals[1])
+        self.addCleanup(portfolio.close)
+        self.assertIsNotNone(portfolio.plan(time_limit=5))
+        # all configurations finish long before the time limit
+        self.assertEqual(len(portfolio.last_results), len(portfolio.configurations))
+        self.assertIsNone(portfolio.plan(goal=self.goals[0], time_limit=5))
+        self.assertIsNone(portfolio.last_winner)
+
+    def testRunner(self):
+        self.runner.plan_and_execute_goals(self.goals)
+        self.assertIs(self.runner._last_goal, self.goals[1])
+        self.assertEqual(self.memory.get_value('memory.b'), 2)
+        pool = self.runner._planning_pool
+        self.assertIsNotNone(pool)
+        self.runner.plan_and_execute_goals(self.goals)
+        self.assertIs(self.runner._planning_pool, pool, 'Worker processes should be kept')
+
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,265 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import tempfile
+import unittest
+
+from rgoap.common import Condition, WorldState, Precondition, Goal
+from rgoap.memory import Memory, MemoryCondition, MemoryChangeVarAction
+from rgoap.planning import Planner
+from rgoap.plancache import PlanCache, PlanStore
+from rgoap.runner import Runner
+
+
+
+class ContextAction(MemoryChangeVarAction):
+
+    def __init__(self, *args):
+        MemoryChangeVarAction.__init__(self, *args)
+        self.context_valid = True
+
+    def check_freeform_context(self):
+        return self.context_valid
+
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        Condition._conditions_dict.clear() # start every test without previous conditions
+        self.memory = Memory()
+        for state_name in ['memory.a', 'memory.b', 'memory.c']:
+            Condition.add(MemoryCondition(self.memory, state_name, 0))
+        self.actions = set()
+        for state_name in ['memory.a', 'memory.b']:
+            for value in range(3):
+                self.actions.add(ContextAction(self.memory, state_name, value, value + 1))
+        self.worldstate = WorldState()
+        Condition.initialize_worldstate(self.worldstate)
+        self.goal = Goal([Precondition(Condition.get('memory.a'), 2),
+                          Precondition(Condition.get('memory.b'), 1)])
+        self.planner = Planner(self.actions, self.worldstate, self.goal)
+        self.cache = PlanCache(2)
+
+    def _plan_and_put(self):
+        start_node = self.planner.plan()
+        self.cache.put(self.goal, start_node, self.actions)
+        return start_node
+
+    def _update_worldstate(self, state_name, value):
+        self.memory.set_value(state_name, value)
+        Condition.initialize_worldstate(self.worldstate)
+
+    def testRegressPlan(self):
+        start_node = self.planner.plan()
+        actions = start_node.parent_actions_path_list[::-1] # in execution order
+        regressed_node = self.planner.regress_plan(actions)
+        self.assertEqual(regressed_node.parent_actions_path_list,
+                         start_node.parent_actions_path_list)
+        self.assertEqual(regressed_node.worldstate, start_node.worldstate)
+        self.assertEqual(regressed_node.path_cost(), start_node.path_cost())
+        self.assertEqual(regressed_node.heuristic_distance, 0)
+        self.assertEqual(self.planner.last_goal_node.heuristic_distance, start_node.path_cost())
+        self.assertIsNone(self.planner.regress_plan(actions[1:]),
+                          'Plan without first action should not be valid')
+
+    def testRegressPlanKeepsSearch(self):
+        start_node = self.planner.plan()
+        graph = self.planner._search_graph
+        self.assertIsNotNone(self.planner.regress_plan(start_node.parent_actions_path_list[::-1]))
+        self.assertIs(self.planner._search_graph, graph,
+                      'Reusing a plan should not discard the search kept for replan()')
+        self.assertIsNotNone(self.planner.replan())
+        self.assertEqual(self.planner.last_stats.expanded_nodes, 0)
+
+    def testHit(self):
+        start_node = self._plan_and_put()
+        cached_node = self.cache.get(self.planner, self.goal, self.worldstate, self.actions)
+        self.assertIsNotNone(cached_node)
+        self.assertEqual(cached_node.parent_actions_path_list,
+                         start_node.parent_actions_path_list)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+
+    def testIrrelevantConditionChanged(self):
+        self._plan_and_put()
+        self._update_worldstate('memory.c', 5)
+        self.assertIsNotNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions),
+                             'Plan should not depend on memory.c')
+
+    def testRelevantConditionChanged(self):
+        self._plan_and_put()
+        self._update_worldstate('memory.a', 1)
+        self.assertIsNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions))
+        self.assertEqual(self.cache.misses, 1)
+
+    def testRevalidation(self):
+        start_node = self._plan_and_put()
+        start_node.action.context_valid = False
+        self.assertIsNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions))
+        self.assertEqual(len(self.cache), 0, 'Invalid plan should be dropped')
+
+    def testActionsChanged(self):
+        self._plan_and_put()
+        self.actions.add(ContextAction(self.memory, 'memory.a', 0, 2))
+        self.assertIsNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions))
+        self.assertEqual(len(self.cache), 0)
+
+    def testLeastRecentlyUsedEviction(self):
+        self._plan_and_put()
+        self._update_worldstate('memory.a', 1)
+        self._plan_and_put()
+        self._update_worldstate('memory.a', 0)
+        # use the first plan, so the second one is least recently used
+        self.assertIsNotNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions))
+        self._update_worldstate('memory.b', 1)
+        self._plan_and_put()
+        self.assertEqual(len(self.cache), 2)
+        self._update_worldstate('memory.b', 0)
+        self.assertIsNotNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions))
+        self._update_worldstate('memory.a', 1)
+        self.assertIsNone(self.cache.get(self.planner, self.goal, self.worldstate, self.actions))
+
+    def testRunner(self):
+        runner = Runner(plan_cache_size=10)
+        runner.actions.update(self.actions)
+        start_node = runner.update_and_plan(self.goal)
+        cached_node = runner.update_and_plan(self.goal)
+        self.assertEqual(cached_node.parent_actions_path_list,
+                         start_node.parent_actions_path_list)
+        self.assertEqual(runner.plan_cache.hits, 1)
+        self.assertIs(runner.planner.last_goal_node, cached_node.parent_nodes_path_list[0])
+
+    def testRunnerWithStore(self):
+        (handle, path) = tempfile.mkstemp('.sqlite')
+        os.close(handle)
+        try:
+            runner = Runner(plan_store_path=path)
+            runner.actions.update(self.actions)
+            start_node = runner.update_and_plan(self.goal)
+            runner.plan_store.close()
+            # restarted runner
+            runner = Runner(plan_store_path=path)
+            runner.actions.update(self.actions)
+            stored_node = runner.update_and_plan(self.goal)
+            self.assertEqual(stored_node.parent_actions_path_list,
+                             start_node.parent_actions_path_list)
+            self.assertEqual(runner.plan_store.hits, 1)
+            runner.plan_store.close()
+        finally:
+            os.remove(path)
+
+
+
+class PlanStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        (handle, self.path) = tempfile.mkstemp('.sqlite')
+        os.close(handle)
+        self._setup_domain()
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.path)
+
+    def _setup_domain(self):
+        """create conditions, actions and store anew, as after a restart"""
+        Condition._conditions_dict.clear() # start every test without previous conditions
+        self.memory = Memory()
+        for state_name in ['memory.a', 'memory.b']:
+            Condition.add(MemoryCondition(self.memory, state_name, 0))
+        self.actions = set()
+        for state_name in ['memory.a', 'memory.b']:
+            for value in range(3):
+                self.actions.add(MemoryChangeVarAction(self.memory, state_name, value, value + 1))
+        self.worldstate = WorldState()
+        Condition.initialize_worldstate(self.worldstate)
+        self.goal = Goal([Precondition(Condition.get('memory.a'), 2)])
+        self.planner = Planner(self.actions, self.worldstate, self.goal)
+        self.store = PlanStore(self.path, 2)
+
+    def _get(self):
+        return self.store.get(self.planner, self.goal, self.worldstate, self.actions)
+
+    def testRestart(self):
+        start_node = self.planner.plan()
+        self.store.put(self.goal, start_node, self.actions)
+        self.store.close()
+        self._setup_domain()
+        stored_node = self._get()
+        self.assertIsNotNone(stored_node)
+        self.assertEqual(repr(stored_node.parent_actions_path_list),
+                         repr(start_node.parent_actions_path_list))
+        for action in stored_node.parent_actions_path_list:
+            self.assertIn(action, self.actions)
+        self.assertEqual(self.store.hits, 1)
+
+    def testActionsChanged(self):
+        self.store.put(self.goal, self.planner.plan(), self.actions)
+        self.actions.add(MemoryChangeVarAction(self.memory, 'memory.a', 0, 2))
+        self.assertIsNone(self._get())
+        self.assertEqual(self.store.misses, 1)
+
+    def testRelevantConditionChanged(self):
+        self.store.put(self.goal, self.planner.plan(), self.actions)
+        self.memory.set_value('memory.a', 1)
+        Condition.initialize_worldstate(self.worldstate)
+        self.assertIsNone(self._get())
+        self.memory.set_value('memory.b', 1)
+        self.memory.set_value('memory.a', 0)
+        Condition.initialize_worldstate(self.worldstate)
+        self.assertIsNotNone(self._get(), 'Plan should not depend on memory.b')
+
+    def testUnknownCondition(self):
+        start_node = self.planner.plan()
+        # a condition that was never added
+        start_node.worldstate.set_condition_value(MemoryCondition(self.memory, 'memory.x', 0), 0)
+        self.store.put(self.goal, start_node, self.actions)
+        self.assertEqual(len(self.store), 0)
+
+    def testEviction(self):
+        for value in range(3):
+            self.memory.set_value('memory.a', value)
+            Condition.initialize_worldstate(self.worldstate)
+            self.store.put(self.goal, self.planner.plan(), self.actions)
+        self.assertEqual(len(self.store), 2)
+        self.memory.set_value('memory.a', 0)
+        Condition.initialize_worldstate(self.worldstate)
+        self.assertIsNone(self._get(), 'Least recently used plan should be deleted')
+
+    def testAmbiguousActions(self):
+        self.actions.add(MemoryChangeVarAction(self.memory, 'memory.a', 0, 1))
+        self.store.put(self.goal, self.planner.plan(), self.actions)
+        self.assertEqual(len(self.store), 0)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
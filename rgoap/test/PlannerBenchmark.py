@@ -0,0 +1,337 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Planner benchmark, run as script: python PlannerBenchmark.py
+"""
+
+
+import logging
+import time
+
+from rgoap import Condition, WorldState, Precondition, Goal
+from rgoap import Memory, MemoryCondition
+from rgoap import Planner, PlanningBudget
+from rgoap import RelativeDistanceHeuristic, ZeroHeuristic
+from rgoap import HMaxHeuristic, HAddHeuristic, RelaxedPlanHeuristic
+from rgoap import Effect
+from rgoap.memory import MemoryChangeVarAction, MemoryIncrementerAction
+from rgoap.memory import MemorySetVarAction
+
+
+
+def setup_change_var_domain(num_vars, num_values, num_goal_vars=3):
+    """Return (actions, start_worldstate, goal) for a domain with num_vars
+    memory variables, each of which can be changed stepwise between its
+    num_values values in a ring (both directions, so the action set is
+    cyclic). The goal needs num_goal_vars variables to be changed to the
+    value farthest away from the start value."""
+    Condition._conditions_dict.clear()
+    memory = Memory()
+    actions = set()
+    for i in range(num_vars):
+        state_name = 'bench.var%d' % i
+        Condition.add(MemoryCondition(memory, state_name, 0))
+        for old_value in range(num_values):
+            for new_value in [(old_value + 1) % num_values,
+                              (old_value - 1) % num_values]:
+                actions.add(MemoryChangeVarAction(memory, state_name,
+                                                  old_value, new_value))
+
+    worldstate = WorldState()
+    Condition.initialize_worldstate(worldstate)
+
+    goal = Goal([Precondition(Condition.get('bench.var%d' % i), num_values // 2)
+                 for i in range(num_goal_vars)])
+
+    return actions, worldstate, goal
+
+
+class CalculatedCostChangeVarAction(MemoryChangeVarAction):
+    """MemoryChangeVarAction with a calculated and validated cost"""
+
+    def cost(self):
+        return self.validate_cost(abs(2 - float(1) / abs(self._new_value - self._old_value)))
+
+
+def setup_calculated_cost_domain(num_vars, num_values, num_goal_vars=3):
+    """Return (actions, start_worldstate, goal) for the change_var domain
+    with CalculatedCostChangeVarActions"""
+    (actions, worldstate, goal) = setup_change_var_domain(num_vars, num_values, num_goal_vars)
+    actions = set(CalculatedCostChangeVarAction(action._memory, action._state_name,
+                                                action._old_value, action._new_value)
+                  for action in actions)
+    return actions, worldstate, goal
+
+
+def setup_incrementer_domain(goal_value, increments=(1, 3, -4, 11)):
+    """Return (actions, start_worldstate, goal) for a numeric domain with a
+    counter changed by incrementer actions."""
+    Condition._conditions_dict.clear()
+    memory = Memory()
+    Condition.add(MemoryCondition(memory, 'bench.counter', 0))
+    actions = set(MemoryIncrementerAction(memory, 'bench.counter', increment)
+                  for increment in increments)
+
+    worldstate = WorldState()
+    Condition.initialize_worldstate(worldstate)
+
+    goal = Goal([Precondition(Condition.get('bench.counter'), goal_value)])
+
+    return actions, worldstate, goal
+
+
+def setup_delivery_domain(num_locations, num_items, num_goal_items):
+    """Return (actions, start_worldstate, goal) for a domain with a robot
+    moving along a line of locations, which has to carry items one by one
+    to the last location."""
+    Condition._conditions_dict.clear()
+    memory = Memory()
+    Condition.add(MemoryCondition(memory, 'robot.at', 0))
+    Condition.add(MemoryCondition(memory, 'robot.holding', -1))
+    for item in range(num_items):
+        Condition.add(MemoryCondition(memory, 'item%d.at' % item,
+                                      (item * 2 + 1) % num_locations))
+
+    robot_at = Condition.get('robot.at')
+    holding = Condition.get('robot.holding')
+    actions = set()
+    for location in range(num_locations):
+        for next_location in [location - 1, location + 1]:
+            if 0 <= next_location < num_locations:
+                actions.add(MemorySetVarAction(memory, 'robot.at', next_location,
+                                               [Precondition(robot_at, location)],
+                                               [Effect(robot_at, next_location)]))
+        for item in range(num_items):
+            item_at = Condition.get('item%d.at' % item)
+            actions.add(MemorySetVarAction(memory, 'robot.holding', item,
+                                           [Precondition(robot_at, location),
+                                            Precondition(item_at, location),
+                                            Precondition(holding, -1)],
+                                           [Effect(holding, item),
+                                            Effect(item_at, -1)]))
+            actions.add(MemorySetVarAction(memory, 'robot.holding', -1,
+                                           [Precondition(robot_at, location),
+                                            Precondition(holding, item)],
+                                           [Effect(holding, -1),
+                                            Effect(item_at, location)]))
+
+    worldstate = WorldState()
+    Condition.initialize_worldstate(worldstate)
+
+    goal = Goal([Precondition(Condition.get('item%d.at' % item), num_locations - 1)
+                 for item in range(num_goal_items)])
+
+    return actions, worldstate, goal
+
+
+def run_benchmark(name, actions, worldstate, goal, repetitions=3, heuristic=None):
+    """Plan repeatedly and print duration and expansion rate"""
+    planner = Planner(actions, worldstate, goal, heuristic)
+    durations = []
+    for _ in range(repetitions):
+        start_time = time.time()
+        start_node = planner.plan()
+        durations.append(time.time() - start_time)
+    duration = min(durations)
+    stats = planner.last_stats
+    print '%-44s actions=%5d  plan=%-5s  expanded=%5d  generated=%6d  ' \
+          'pruned=%5d  time=%8.2fms  expansions/s=%8.0f' % (
+              name, len(actions),
+              None if start_node is None else len(start_node.parent_actions_path_list),
+              stats.expanded_nodes, stats.generated_nodes, stats.pruned_nodes,
+              duration * 1000, stats.expanded_nodes / duration)
+
+
+def run_anytime_benchmark(name, actions, worldstate, goal, time_limit=0.05, heuristic=None):
+    """Plan anytime and print when which plan was found"""
+    planner = Planner(actions, worldstate, goal, heuristic)
+    start_node = planner.plan_anytime(time_limit)
+    stats = planner.last_stats
+    print '%-44s actions=%5d  plan=%-5s  expanded=%5d  time=%8.2fms  plans=%s' % (
+              name, len(actions),
+              None if start_node is None else len(start_node.parent_actions_path_list),
+              stats.expanded_nodes, stats.duration * 1000,
+              ', '.join('%.2fms cost=%s bound=%.2f' % (duration * 1000, cost, bound)
+                        for (duration, cost, bound) in stats.plans))
+
+
+def count_net_nodes(goal_node):
+    """Return the number of nodes reachable from the goal node"""
+    nodes = [goal_node]
+    num_nodes = 0
+    while len(nodes) > 0:
+        node = nodes.pop()
+        num_nodes += 1
+        nodes.extend(node.possible_prev_nodes)
+    return num_nodes
+
+
+def run_memory_benchmark(name, actions, worldstate, goal, heuristic=None):
+    """Compare the nodes kept by plan() and plan_iterative_deepening()"""
+    planner = Planner(actions, worldstate, goal, heuristic)
+    for mode, plan in [('A*', planner.plan),
+                       ('IDA*', planner.plan_iterative_deepening)]:
+        start_node = plan()
+        stats = planner.last_stats
+        print '%-44s %-5s plan=%-5s  expanded=%5d  kept nodes=%6d  time=%8.2fms' % (
+                  name, mode,
+                  None if start_node is None else len(start_node.parent_actions_path_list),
+                  stats.expanded_nodes, count_net_nodes(planner.last_goal_node),
+                  stats.duration * 1000)
+
+
+def run_cost_benchmark(name, actions, worldstate, goal, repetitions=3, heuristic=None):
+    """Compare the expansion rate of actions with static and dynamic costs"""
+    action_class = iter(actions).next().__class__
+    for static_cost in [False, True]:
+        action_class.static_cost = static_cost
+        run_benchmark('%s static_cost=%s' % (name, static_cost),
+                      actions, worldstate, goal, repetitions, heuristic)
+    del action_class.static_cost
+
+
+def run_replan_benchmark(name, actions, worldstate, goal, changes, heuristic_class):
+    """Plan, then change the start worldstate step by step and compare
+    replanning with the previous search against planning anew"""
+    budget = PlanningBudget(max_expansions=5000)
+    replanner = Planner(actions, worldstate, goal, heuristic_class(), budget)
+    replanner.plan()
+    for (state_name, value) in changes:
+        worldstate = WorldState(worldstate)
+        worldstate.set_condition_value(Condition.get(state_name), value)
+        results = []
+        for planner in [replanner, Planner(actions, worldstate, goal, heuristic_class(), budget)]:
+            start_time = time.time()
+            if planner is replanner:
+                start_node = planner.replan(worldstate)
+            else:
+                start_node = planner.plan()
+            results.append(((time.time() - start_time) * 1000, planner.last_stats.expanded_nodes,
+                            None if start_node is None else start_node.path_cost()))
+        print '%-44s %s=%-3s replan: %8.2fms expanded=%5d cost=%-5s  ' \
+              'plan: %8.2fms expanded=%5d cost=%s' % ((name, state_name, value) +
+                                                        results[0] + results[1])
+
+
+def run_repair_benchmark(name, actions, worldstate, goal, executed, slip, heuristic_class):
+    """Plan, execute some actions, let a condition slip and compare bridging
+    into the rest of the failed plan against planning anew"""
+    budget = PlanningBudget(max_expansions=5000)
+    planner = Planner(actions, worldstate, goal, heuristic_class(), budget)
+    failed_start_node = planner.plan()
+    nodes = [failed_start_node] + failed_start_node.parent_nodes_path_list
+    # the worldstate the executed actions left behind is the one the next
+    # node of the plan requires
+    worldstate = WorldState(worldstate)
+    for (condition, value) in nodes[-executed].worldstate.iteritems():
+        worldstate.set_condition_value(condition, value)
+    (state_name, value) = slip
+    worldstate.set_condition_value(Condition.get(state_name), value)
+    results = []
+    for planner in [planner, Planner(actions, worldstate, goal, heuristic_class(), budget)]:
+        start_time = time.time()
+        if planner.last_stats is not None:
+            start_node = planner.plan_bridge(nodes, worldstate, PlanningBudget(max_expansions=100))
+        else:
+            start_node = planner.plan()
+        results.append(((time.time() - start_time) * 1000, planner.last_stats.expanded_nodes,
+                        None if start_node is None else start_node.path_cost()))
+    print '%-44s %s=%-3s repair: %8.2fms expanded=%5d cost=%-5s  ' \
+          'plan: %8.2fms expanded=%5d cost=%s' % ((name, state_name, value) +
+                                                    results[0] + results[1])
+
+
+def main():
+    logging.getLogger('rgoap').setLevel(logging.ERROR)
+
+    for (num_vars, num_values, num_goal_vars) in [(3, 4, 2), (3, 4, 3),
+                                                  (10, 6, 2), (10, 6, 3),
+                                                  (40, 6, 3), (100, 6, 3),
+                                                  (200, 6, 3)]:
+        run_benchmark('change_var vars=%d values=%d goals=%d' % (
+                          num_vars, num_values, num_goal_vars),
+                      *setup_change_var_domain(num_vars, num_values,
+                                               num_goal_vars))
+
+    for heuristic in [RelativeDistanceHeuristic(), ZeroHeuristic(),
+                      HMaxHeuristic(), HAddHeuristic(), RelaxedPlanHeuristic()]:
+        name = heuristic.__class__.__name__
+        run_benchmark('change_var vars=10 values=6 goals=3 ' + name,
+                      *setup_change_var_domain(10, 6, 3), heuristic=heuristic)
+        run_benchmark('incrementer goal=23 ' + name,
+                      *setup_incrementer_domain(23), heuristic=heuristic)
+        run_benchmark('delivery locations=6 items=3 ' + name,
+                      *setup_delivery_domain(6, 3, 2), heuristic=heuristic)
+        run_benchmark('delivery locations=8 items=4 ' + name,
+                      *setup_delivery_domain(8, 4, 3), heuristic=heuristic)
+
+    for heuristic in [RelativeDistanceHeuristic(), HMaxHeuristic(), RelaxedPlanHeuristic()]:
+        name = 'anytime ' + heuristic.__class__.__name__
+        run_anytime_benchmark('change_var vars=10 values=6 goals=3 ' + name,
+                              *setup_change_var_domain(10, 6, 3), heuristic=heuristic)
+        run_anytime_benchmark('incrementer goal=23 ' + name,
+                              *setup_incrementer_domain(23), heuristic=heuristic)
+        run_anytime_benchmark('delivery locations=8 items=4 ' + name,
+                              *setup_delivery_domain(8, 4, 3), heuristic=heuristic)
+
+    run_memory_benchmark('incrementer goal=23 HMaxHeuristic',
+                         *setup_incrementer_domain(23), heuristic=HMaxHeuristic())
+    run_memory_benchmark('change_var vars=10 values=6 goals=3 HMaxHeuristic',
+                         *setup_change_var_domain(10, 6, 3), heuristic=HMaxHeuristic())
+
+    for heuristic_class in [RelativeDistanceHeuristic, HMaxHeuristic, RelaxedPlanHeuristic]:
+        run_replan_benchmark('change_var vars=10 values=6 goals=3 ' + heuristic_class.__name__,
+                             *setup_change_var_domain(10, 6, 3),
+                             changes=[('bench.var5', 2), ('bench.var0', 1),
+                                      ('bench.var1', 5), ('bench.var0', 2)],
+                             heuristic_class=heuristic_class)
+        run_replan_benchmark('delivery locations=8 items=4 ' + heuristic_class.__name__,
+                             *setup_delivery_domain(8, 4, 3),
+                             changes=[('item3.at', 2), ('robot.at', 2),
+                                      ('item0.at', 4), ('robot.at', 6)],
+                             heuristic_class=heuristic_class)
+
+    run_cost_benchmark('calculated_cost vars=100 values=5 goals=3',
+                       *setup_calculated_cost_domain(100, 5, 3))
+    run_cost_benchmark('calculated_cost vars=100 values=5 goals=3 RelaxedPlanHeuristic',
+                       *setup_calculated_cost_domain(100, 5, 3),
+                       heuristic=RelaxedPlanHeuristic())
+
+    for heuristic_class in [RelativeDistanceHeuristic, HMaxHeuristic, RelaxedPlanHeuristic]:
+        for slip in [('robot.at', 2), ('item0.at', 4)]:
+            run_repair_benchmark('delivery locations=8 items=4 ' + heuristic_class.__name__,
+                                 *setup_delivery_domain(8, 4, 3), executed=2, slip=slip,
+                                 heuristic_class=heuristic_class)
+
+
+
+if __name__ == '__main__':
+    main()
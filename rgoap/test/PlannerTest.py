@@ -0,0 +1,601 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+from time import time
+
+from rgoap.common import Condition, WorldState, Precondition, Effect, Goal
+from rgoap.memory import Memory, MemoryCondition, MemoryChangeVarAction
+from rgoap.memory import MemoryIncrementerAction, MemorySetVarAction
+from rgoap.heuristics import ZeroHeuristic, HMaxHeuristic, HAddHeuristic
+from rgoap.heuristics import RelaxedPlanHeuristic, INFINITY
+from rgoap.planning import Planner, PlanningBudget, CancellationToken, _OpenList
+from rgoap.planning import PLAN_FOUND, NO_PLAN, BUDGET_EXHAUSTED
+from rgoap.runner import Runner
+
+from PlannerBenchmark import setup_change_var_domain, setup_delivery_domain
+
+
+class FakeNode(object):
+
+    def __init__(self, total_cost, heuristic_distance=0):
+        self._total_cost = total_cost
+        self.heuristic_distance = heuristic_distance
+
+    def path_cost(self):
+        return self._total_cost - self.heuristic_distance
+
+    def total_cost(self):
+        return self._total_cost
+
+
+class PushedCondition(Condition):
+
+    pushes_values = True
+
+    def __init__(self, state_name, value):
+        Condition.__init__(self, state_name)
+        self.value = value
+        self.polls = 0
+
+    def get_value(self):
+        self.polls += 1
+        return self.value
+
+    def set_value(self, value):
+        self.value = value
+        self.notify_observers()
+
+
+
+class OpenListTest(unittest.TestCase):
+
+    def testOrder(self):
+        nodes = [FakeNode(c) for c in [3, 1, 2.5, 0]]
+        open_list = _OpenList(nodes)
+        self.assertEqual([open_list.pop() for _ in nodes],
+                         sorted(nodes, key=lambda node: node.total_cost()))
+        self.assertEqual(len(open_list), 0)
+
+    def testStableTies(self):
+        old_nodes = [FakeNode(1), FakeNode(2)]
+        open_list = _OpenList(old_nodes)
+        new_nodes = [FakeNode(1), FakeNode(2), FakeNode(1)]
+        for node in new_nodes:
+            open_list.push(node)
+        # same as a stable sort over old and new nodes
+        expected = sorted(old_nodes + new_nodes, key=lambda node: node.total_cost())
+        self.assertEqual(open_list.nodes(), expected)
+        self.assertEqual([open_list.pop() for _ in expected], expected)
+
+    def testWeight(self):
+        near_node = FakeNode(4, 1)
+        far_node = FakeNode(3, 3)
+        open_list = _OpenList([far_node, near_node])
+        self.assertEqual(open_list.nodes(), [far_node, near_node])
+        open_list.set_weight(2)
+        self.assertEqual(open_list.min_priority(), 5)
+        self.assertEqual(open_list.nodes(), [near_node, far_node])
+        open_list.set_weight(INFINITY)
+        self.assertEqual(open_list.min_priority(), INFINITY)
+        self.assertEqual(open_list.nodes(), [near_node, far_node])
+        open_list.set_weight(1)
+        self.assertEqual(open_list.nodes(), [far_node, near_node])
+
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        Condition._conditions_dict.clear() # start every test without previous conditions
+        self.memory = Memory()
+        Condition.add(MemoryCondition(self.memory, 'memory.a', 0))
+        Condition.add(MemoryCondition(self.memory, 'memory.b', 0))
+        # cyclic action set: every value can be changed forth and back
+        self.actions = set()
+        for state_name in ['memory.a', 'memory.b']:
+            for value in range(4):
+                self.actions.add(MemoryChangeVarAction(self.memory, state_name,
+                                                       value, (value + 1) % 4))
+                self.actions.add(MemoryChangeVarAction(self.memory, state_name,
+                                                       (value + 1) % 4, value))
+        self.worldstate = WorldState()
+        Condition.initialize_worldstate(self.worldstate)
+        self.goal = Goal([Precondition(Condition.get('memory.a'), 2),
+                          Precondition(Condition.get('memory.b'), 2)])
+        self.planner = Planner(self.actions, self.worldstate, self.goal)
+
+    def testCyclicActions(self):
+        start_node = self.planner.plan()
+        self.assertIsNotNone(start_node, 'There should be a plan')
+        self.assertEqual(len(start_node.parent_actions_path_list), 4, 'Plan should have four actions')
+        self.assertGreater(self.planner.last_stats.pruned_nodes, 0, 'Duplicates should be pruned')
+
+    def testPathLists(self):
+        start_node = self.planner.plan()
+        nodes = start_node.parent_nodes_path_list
+        actions = start_node.parent_actions_path_list
+        self.assertTrue(nodes[0].is_goal(), 'Node path should begin with the goal node')
+        self.assertIs(nodes[-1], start_node.parent_node())
+        self.assertIs(actions[-1], start_node.action)
+        self.assertEqual(actions[:-1], start_node.parent_node().parent_actions_path_list)
+        self.assertEqual(start_node.path_cost(), sum(action.cost() for action in actions))
+
+    def testActionsAddedLater(self):
+        actions = set()
+        planner = Planner(actions, self.worldstate, self.goal)
+        self.assertIsNone(planner.plan(), 'There should be no plan without actions')
+        actions.update(self.actions)
+        self.assertIsNotNone(planner.plan(), 'Added actions should be used')
+
+    def testUnsatisfiedConditions(self):
+        self.planner.plan()
+        nodes = [self.planner.last_goal_node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            self.assertEqual(node.unsatisfied_conditions,
+                             node.worldstate.get_unsatisfied_conditions(self.worldstate),
+                             'Incrementally derived conditions should match')
+            nodes.extend(node.possible_prev_nodes)
+
+    def testHeuristics(self):
+        expanded_nodes = {}
+        for heuristic in [ZeroHeuristic(), HMaxHeuristic(), HAddHeuristic(),
+                          RelaxedPlanHeuristic()]:
+            planner = Planner(self.actions, self.worldstate, self.goal, heuristic)
+            start_node = planner.plan()
+            self.assertIsNotNone(start_node, 'There should be a plan with %s' % heuristic)
+            self.assertEqual(len(start_node.parent_actions_path_list), 4,
+                             'Plan with %s should have four actions' % heuristic)
+            expanded_nodes[heuristic.__class__] = planner.last_stats.expanded_nodes
+        self.assertLessEqual(expanded_nodes[HMaxHeuristic], expanded_nodes[ZeroHeuristic])
+
+    def testHMaxValues(self):
+        heuristic = HMaxHeuristic()
+        planner = Planner(self.actions, self.worldstate, self.goal, heuristic)
+        planner.plan()
+        goal_node = planner.last_goal_node
+        # both conditions need two steps from 0 to 2
+        self.assertEqual(goal_node.heuristic_distance, 2)
+        for node in goal_node.possible_prev_nodes:
+            self.assertGreaterEqual(node.heuristic_distance, 1)
+
+    def testRelaxedPlanValues(self):
+        heuristic = RelaxedPlanHeuristic()
+        planner = Planner(self.actions, self.worldstate, self.goal, heuristic)
+        planner.plan()
+        # the relaxed plan needs two steps for each condition
+        self.assertEqual(planner.last_goal_node.heuristic_distance, 4)
+
+    def testUnreachableGoal(self):
+        goal = Goal([Precondition(Condition.get('memory.a'), 7)])
+        planner = Planner(self.actions, self.worldstate, goal, HMaxHeuristic())
+        self.assertIsNone(planner.plan(), 'There should be no plan')
+        self.assertEqual(planner.last_stats.expanded_nodes, 0,
+                         'Relaxed heuristic should detect the dead end')
+        self.assertEqual(planner.last_stats.status, NO_PLAN)
+
+    def testVariableEffects(self):
+        actions = set([MemoryIncrementerAction(self.memory, 'memory.a', 1),
+                       MemoryIncrementerAction(self.memory, 'memory.a', 3)])
+        goal = Goal([Precondition(Condition.get('memory.a'), 7)])
+        for heuristic in [ZeroHeuristic(), HMaxHeuristic(), HAddHeuristic(),
+                          RelaxedPlanHeuristic()]:
+            planner = Planner(actions, self.worldstate, goal, heuristic)
+            start_node = planner.plan()
+            self.assertIsNotNone(start_node, 'There should be a plan with %s' % heuristic)
+
+    def testAnytime(self):
+        for heuristic in [HMaxHeuristic(), RelaxedPlanHeuristic()]:
+            planner = Planner(self.actions, self.worldstate, self.goal, heuristic)
+            start_node = planner.plan_anytime(10)
+            self.assertIsNotNone(start_node, 'There should be a plan with %s' % heuristic)
+            self.assertEqual(len(start_node.parent_actions_path_list), 4,
+                             'Final plan with %s should have four actions' % heuristic)
+            self.assertEqual(start_node.suboptimality_bound, 1)
+            plans = planner.last_stats.plans
+            self.assertGreater(len(plans), 0)
+            for (_, cost, bound), (_, next_cost, next_bound) in zip(plans, plans[1:]):
+                self.assertLessEqual(next_cost, cost)
+                self.assertLess(next_bound, bound)
+
+    def testAnytimeGreedyStart(self):
+        planner = Planner(self.actions, self.worldstate, self.goal, RelaxedPlanHeuristic())
+        start_time = time()
+        start_node = planner.plan_anytime(5, initial_weight=INFINITY)
+        self.assertLess(time() - start_time, 5, 'Search with weight 1 should finish early')
+        self.assertEqual(len(start_node.parent_actions_path_list), 4)
+        self.assertEqual(start_node.suboptimality_bound, 1)
+
+    def testAnytimeTimeLimit(self):
+        self.assertIsNone(self.planner.plan_anytime(0), 'There should be no time to plan')
+        self.assertEqual(self.planner.last_stats.status, BUDGET_EXHAUSTED)
+        self.assertEqual(self.planner.last_stats.exhausted_limit, 'time_limit')
+
+    def testIterativeDeepening(self):
+        for heuristic in [ZeroHeuristic(), HMaxHeuristic()]:
+            planner = Planner(self.actions, self.worldstate, self.goal, heuristic)
+            start_node = planner.plan_iterative_deepening()
+            self.assertIsNotNone(start_node, 'There should be a plan with %s' % heuristic)
+            self.assertEqual(len(start_node.parent_actions_path_list), 4,
+                             'Plan with %s should have four actions' % heuristic)
+            # only the plan's nodes are kept
+            node = planner.last_goal_node
+            for plan_node in start_node.parent_nodes_path_list[1:] + [start_node]:
+                self.assertEqual(node.possible_prev_nodes, [plan_node])
+                node = plan_node
+            self.assertEqual(start_node.possible_prev_nodes, [])
+
+    def testIterativeDeepeningMaxDepth(self):
+        start_node = self.planner.plan_iterative_deepening(max_depth=3)
+        self.assertIsNone(start_node, 'There should be no plan with three actions')
+        self.assertEqual(self.planner.last_goal_node.possible_prev_nodes, [])
+        self.assertEqual(self.planner.last_stats.exhausted_limit, 'max_depth')
+        self.assertEqual(self.planner.last_stats.live_nodes, 1)
+
+    def testStatusPlanFound(self):
+        self.assertIsNotNone(self.planner.plan())
+        self.assertEqual(self.planner.last_stats.status, PLAN_FOUND)
+        self.assertIsNone(self.planner.last_stats.exhausted_limit)
+
+    def testBudgets(self):
+        for budget, limit in [(PlanningBudget(time_limit=0), 'time_limit'),
+                              (PlanningBudget(max_expansions=3), 'max_expansions'),
+                              (PlanningBudget(max_generated_nodes=3), 'max_generated_nodes'),
+                              (PlanningBudget(max_live_nodes=3), 'max_live_nodes')]:
+            self.assertIsNone(self.planner.plan(budget=budget),
+                              'There should be no plan with %s' % budget)
+            stats = self.planner.last_stats
+            self.assertEqual(stats.status, BUDGET_EXHAUSTED)
+            self.assertEqual(stats.exhausted_limit, limit)
+        # limits are checked before each expansion, which adds up to four nodes
+        self.assertLessEqual(stats.live_nodes, 3 + 4)
+
+    def testDefaultBudget(self):
+        self.planner.budget = PlanningBudget(max_expansions=1)
+        self.assertIsNone(self.planner.plan())
+        self.assertEqual(self.planner.last_stats.expanded_nodes, 1)
+        self.assertIsNone(self.planner.plan_iterative_deepening(budget=PlanningBudget(max_expansions=1)))
+        self.assertEqual(self.planner.last_stats.exhausted_limit, 'max_expansions')
+
+    def _change_start(self, state_name, value):
+        self.memory.set_value(state_name, value)
+        Condition.initialize_worldstate(self.worldstate)
+
+    def testReplan(self):
+        self.planner.plan()
+        for (state_name, value) in [('memory.a', 1), ('memory.b', 3), ('memory.a', 2)]:
+            self._change_start(state_name, value)
+            start_node = self.planner.replan()
+            replan_stats = self.planner.last_stats
+            self.assertTrue(start_node.worldstate.matches(self.worldstate))
+            planner = Planner(self.actions, self.worldstate, self.goal)
+            self.assertEqual(start_node.path_cost(), planner.plan().path_cost())
+            self.assertLessEqual(replan_stats.expanded_nodes, planner.last_stats.expanded_nodes)
+
+    def testReplanBenchmarkDomains(self):
+        # the zero heuristic is admissible, so both plans must cost the same
+        for (setup_domain, args, changes) in [
+                (setup_change_var_domain, (10, 6, 3),
+                 [('bench.var5', 2), ('bench.var0', 1), ('bench.var0', 2)]),
+                (setup_delivery_domain, (6, 3, 2),
+                 [('item1.at', 2), ('robot.at', 2), ('item0.at', 4)])]:
+            (actions, worldstate, goal) = setup_domain(*args)
+            budget = PlanningBudget(max_expansions=5000)
+            replanner = Planner(actions, worldstate, goal, ZeroHeuristic(), budget)
+            replanner.plan()
+            for (state_name, value) in changes:
+                worldstate = WorldState(worldstate)
+                worldstate.set_condition_value(Condition.get(state_name), value)
+                start_node = replanner.replan(worldstate)
+                planner = Planner(actions, worldstate, goal, ZeroHeuristic(), budget)
+                self.assertLessEqual(start_node.path_cost(), planner.plan().path_cost())
+
+    def testReplanGrowth(self):
+        self.planner.plan()
+        graph = self.planner._search_graph
+        self._change_start('memory.a', 1)
+        self.planner.replan()
+        self.assertIs(self.planner._search_graph, graph)
+        self.planner.replan_max_growth = 0
+        self._change_start('memory.b', 3)
+        self.planner.replan()
+        self.assertIsNot(self.planner._search_graph, graph, 'Grown search should be dropped')
+
+    def testReplanUnchanged(self):
+        start_node = self.planner.plan()
+        self.assertIs(self.planner.replan(), start_node)
+        self.assertEqual(self.planner.last_stats.expanded_nodes, 0)
+
+    def testReplanFreeformContext(self):
+        class ContextAction(MemorySetVarAction):
+            context_valid = True
+            def check_freeform_context(self):
+                return self.context_valid
+        shortcut = ContextAction(self.memory, 'memory.a', 2,
+                                 [Precondition(Condition.get('memory.a'), 0)],
+                                 [Effect(Condition.get('memory.a'), 2)])
+        self.actions.add(shortcut)
+        self.assertIn(shortcut, self.planner.plan().parent_actions_path_list)
+        shortcut.context_valid = False
+        start_node = self.planner.replan()
+        self.assertNotIn(shortcut, start_node.parent_actions_path_list)
+        self.assertEqual(len(start_node.parent_actions_path_list), 4)
+        shortcut.context_valid = True
+        self.assertIn(shortcut, self.planner.replan().parent_actions_path_list)
+
+    def testReplanOtherGoal(self):
+        self.planner.plan()
+        goal = Goal([Precondition(Condition.get('memory.a'), 1)])
+        start_node = self.planner.replan(goal=goal)
+        self.assertEqual(len(start_node.parent_actions_path_list), 1)
+        self.assertIs(self.planner.last_goal_node.parent, None)
+
+    def testFreeformContextCache(self):
+        class CountingAction(MemoryChangeVarAction):
+            freeform_context_ttl = 60
+            checks = 0
+            def check_freeform_context(self):
+                CountingAction.checks += 1
+                return True
+        actions = [CountingAction(self.memory, 'memory.a', value, value + 1)
+                   for value in range(3)]
+        self.actions.update(actions)
+        self.planner.context_check_threads = 2
+        self.addCleanup(self.planner.close)
+        self.planner.plan()
+        self.assertEqual(CountingAction.checks, 3)
+        pool = self.planner._context_check_pool
+        self.planner.plan()
+        self.assertEqual(CountingAction.checks, 3, 'Checks should be reused within the TTL')
+        self.assertIs(self.planner._context_check_pool, pool, 'Threads should be kept')
+        actions[0].invalidate_freeform_context()
+        self.planner.context_check_threads = 0
+        self.planner.plan()
+        self.assertEqual(CountingAction.checks, 4)
+        CountingAction.freeform_context_ttl = 0
+        self.planner.plan()
+        self.assertEqual(CountingAction.checks, 7)
+
+    def testActionCosts(self):
+        # the heuristics on compiled actions ask for costs as well
+        for heuristic in [None, HMaxHeuristic(), RelaxedPlanHeuristic()]:
+            class CostAction(MemoryChangeVarAction):
+                costs_asked = 0
+                def cost(self):
+                    CostAction.costs_asked += 1
+                    return 1
+            actions = set(CostAction(self.memory, state_name, 0, 2)
+                          for state_name in ['memory.a', 'memory.b'])
+            self.assertTrue(iter(self.actions).next().static_cost)
+            self.assertFalse(iter(actions).next().static_cost,
+                             'Overriding cost() should make the cost dynamic')
+            planner = Planner(self.actions | actions, self.worldstate, self.goal, heuristic)
+            self.assertEqual(len(planner.plan().parent_actions_path_list), 2)
+            self.assertEqual(CostAction.costs_asked, 2, 'Costs should be asked once per plan')
+            planner.plan()
+            self.assertEqual(CostAction.costs_asked, 4)
+            CostAction.static_cost = True
+            planner.plan()
+            planner.plan()
+            self.assertEqual(CostAction.costs_asked, 4, 'Static costs should be asked once')
+
+    def testIrrelevantActions(self):
+        Condition.add(MemoryCondition(self.memory, 'memory.c', 0))
+        Condition.initialize_worldstate(self.worldstate)
+        c_actions = set(MemoryChangeVarAction(self.memory, 'memory.c', value, value + 1)
+                        for value in range(3))
+        self.actions.update(c_actions)
+        self.assertIsNotNone(self.planner.plan())
+        self.assertEqual(self.planner.last_stats.irrelevant_actions, 3)
+        # needing c for a makes the actions on c relevant
+        self.actions.add(MemorySetVarAction(self.memory, 'memory.a', 2,
+                                            [Precondition(Condition.get('memory.c'), 3)],
+                                            [Effect(Condition.get('memory.a'), 2)]))
+        self.assertIsNotNone(self.planner.plan())
+        self.assertEqual(self.planner.last_stats.irrelevant_actions, 0)
+
+    def testGoalRelevantPolling(self):
+        Condition.add(MemoryCondition(self.memory, 'memory.c', 0))
+        runner = Runner(goal_relevant_polling=True)
+        runner.actions.update(self.actions)
+        self.assertEqual(runner.planner.get_relevant_conditions(self.goal),
+                         set([Condition.get('memory.a'), Condition.get('memory.b')]))
+        self.assertIsNotNone(runner.update_and_plan(self.goal))
+        self.assertEqual(len(runner.worldstate._indices), 2)
+        # without a goal all conditions are polled
+        runner._update_worldstate()
+        self.assertEqual(len(runner.worldstate._indices), 3)
+        runner.planner.prune_irrelevant_actions = False
+        self.assertEqual(len(runner.planner.get_relevant_conditions(self.goal)), 3)
+
+    def testPushUpdates(self):
+        condition = PushedCondition('pushed', 0)
+        Condition.add(condition)
+        runner = Runner(push_updates=True)
+        runner._update_worldstate()
+        self.assertEqual(condition.polls, 1)
+        version = runner.worldstate_version
+        runner._update_worldstate()
+        self.assertEqual(condition.polls, 1)
+        self.assertFalse(runner.worldstate_changed_since(version))
+        condition.set_value(1)
+        runner._update_worldstate()
+        self.assertEqual(condition.polls, 2)
+        self.assertEqual(runner.worldstate.get_condition_value(condition), 1)
+        self.assertTrue(runner.worldstate_changed_since(version, [condition]))
+        self.assertFalse(runner.worldstate_changed_since(version, [Condition.get('memory.a')]))
+        # polled conditions change the version as well
+        self.memory.set_value('memory.a', 3)
+        runner._update_worldstate()
+        self.assertTrue(runner.worldstate_changed_since(version, [Condition.get('memory.a')]))
+        condition.remove_observer(runner._mark_dirty)
+
+    def testIrrelevantActionsNoPruning(self):
+        class GuardedIncrementerAction(MemoryIncrementerAction):
+            def _generate_variable_preconditions(self, var_effects, worldstate, start_worldstate):
+                # needs c, which relevance pruning cannot know in advance
+                return (MemoryIncrementerAction._generate_variable_preconditions(
+                            self, var_effects, worldstate, start_worldstate) +
+                        [Precondition(Condition.get('memory.c'), 1)])
+        Condition.add(MemoryCondition(self.memory, 'memory.c', 0))
+        Condition.initialize_worldstate(self.worldstate)
+        actions = set([GuardedIncrementerAction(self.memory, 'memory.a', 1),
+                       MemoryChangeVarAction(self.memory, 'memory.c', 0, 1)])
+        goal = Goal([Precondition(Condition.get('memory.a'), 1)])
+        self.assertTrue(MemoryIncrementerAction(self.memory, 'memory.a', 1)
+                        .variable_preconditions_on_effects_only)
+        planner = Planner(actions, self.worldstate, goal)
+        self.assertEqual(len(planner.plan().parent_actions_path_list), 2,
+                         'Pruning should keep actions generating preconditions')
+        self.assertEqual(planner.last_stats.irrelevant_actions, 0)
+        self.assertIn(Condition.get('memory.c'), planner.get_relevant_conditions(goal))
+        planner.prune_irrelevant_actions = False
+        self.assertEqual(len(planner.plan().parent_actions_path_list), 2)
+        self.assertEqual(planner.last_stats.irrelevant_actions, 0)
+
+    def testCancellation(self):
+        polls = []
+        def check():
+            polls.append(self.planner.last_stats.expanded_nodes)
+            return len(polls) > 1
+        token = CancellationToken([check], poll_interval=3)
+        self.assertIsNone(self.planner.plan(budget=PlanningBudget(cancellation=token)))
+        self.assertEqual(self.planner.last_stats.status, BUDGET_EXHAUSTED)
+        self.assertEqual(self.planner.last_stats.exhausted_limit, 'cancelled')
+        self.assertEqual(polls, [0, 3])
+        self.assertEqual(self.planner.last_stats.expanded_nodes, 3)
+        token.checks = []
+        token.cancel()
+        self.assertIsNone(self.planner.plan_anytime(1, budget=PlanningBudget(cancellation=token)))
+        token.reset()
+        self.assertIsNotNone(self.planner.plan(budget=PlanningBudget(cancellation=token)))
+        polls = []
+        token.checks = [check]
+        token.poll_interval = 0
+        self.assertIsNone(self.planner.plan(budget=PlanningBudget(cancellation=token)))
+        self.assertEqual(polls, [0, 1], 'Interval 0 should poll on every expansion')
+
+    def testRunnerCancellation(self):
+        runner = Runner()
+        runner.actions.update(self.actions)
+        runner.request_preempt()
+        self.assertIsNone(runner.update_and_plan(self.goal, tries=3))
+        self.assertEqual(runner.planner.last_stats.exhausted_limit, 'cancelled')
+        self.assertEqual(runner.update_and_plan_and_execute(self.goal), 'preempted')
+        self.assertIsNotNone(runner.update_and_plan(self.goal))
+
+    def testWeightedPlan(self):
+        optimal_cost = self.planner.plan().path_cost()
+        for weight in [3, float('inf')]:
+            start_node = self.planner.plan(weight=weight)
+            self.assertTrue(start_node.worldstate.matches(self.worldstate))
+            self.assertEqual(start_node.suboptimality_bound, weight)
+            self.assertLessEqual(start_node.path_cost(), optimal_cost * weight)
+            self.assertIsNone(self.planner._search_graph, 'Weighted searches should not be kept')
+
+    def testPlanBridge(self):
+        failed_start_node = self.planner.plan()
+        nodes = [failed_start_node] + failed_start_node.parent_nodes_path_list
+        # the first action succeeded, the second one did not start
+        failed_start_node.action.run(None)
+        self._change_start('memory.a', self.memory.get_value('memory.a'))
+        closures = len(self.planner._relevance_closures)
+        start_node = self.planner.plan_bridge(nodes)
+        self.assertIs(start_node.parent, failed_start_node.parent.parent, 'Plan should be spliced')
+        self.assertEqual(len(self.planner._relevance_closures), closures,
+                         'Bridge searches should not be cached')
+        # then b slipped
+        self._change_start('memory.b', 3)
+        start_node = self.planner.plan_bridge(nodes)
+        self.assertTrue(start_node.worldstate.matches(self.worldstate))
+        self.assertTrue(self.goal.is_valid(start_node.parent_nodes_path_list[0].worldstate))
+        planner = Planner(self.actions, self.worldstate, self.goal)
+        self.assertGreaterEqual(start_node.path_cost(), planner.plan().path_cost())
+
+    def testPlanBridgeShorterThanReplan(self):
+        Condition.add(MemoryCondition(self.memory, 'memory.c', 0))
+        Condition.initialize_worldstate(self.worldstate)
+        actions = set(MemoryChangeVarAction(self.memory, 'memory.c', value, value + 1)
+                      for value in range(9))
+        goal = Goal([Precondition(Condition.get('memory.c'), 9)])
+        failed_start_node = Planner(actions, self.worldstate, goal).plan()
+        nodes = [failed_start_node] + failed_start_node.parent_nodes_path_list
+        # two actions succeeded, then c slipped back by one
+        self._change_start('memory.c', 1)
+        bridge_planner = Planner(actions, self.worldstate, goal)
+        start_node = bridge_planner.plan_bridge(nodes)
+        self.assertIs(start_node, failed_start_node.parent, 'Plan should be reused from c=1 on')
+        planner = Planner(actions, self.worldstate, goal)
+        self.assertEqual(start_node.path_cost(), planner.plan().path_cost())
+        self.assertLess(bridge_planner.last_stats.expanded_nodes, planner.last_stats.expanded_nodes)
+
+    def testPlanBridgeBudget(self):
+        failed_start_node = self.planner.plan()
+        nodes = [failed_start_node] + failed_start_node.parent_nodes_path_list
+        self._change_start('memory.a', 3)
+        self._change_start('memory.b', 3)
+        self.assertIsNone(self.planner.plan_bridge(nodes, budget=PlanningBudget(max_expansions=1)))
+        self.assertEqual(self.planner.last_stats.status, BUDGET_EXHAUSTED)
+
+    def testRunnerPlanRepairFallback(self):
+        runner = Runner(incremental_replanning=True,
+                        plan_repair_budget=PlanningBudget(max_expansions=1))
+        runner.actions.update(self.actions)
+        executed = []
+        graphs = []
+        def execute(start_node, introspection=False):
+            executed.append(start_node)
+            if len(executed) > 1:
+                return 'succeeded'
+            # both conditions slipped too far to bridge within the budget
+            self.memory.set_value('memory.a', 3)
+            self.memory.set_value('memory.b', 3)
+            graphs.append(runner.planner._search_graph)
+            return 'aborted'
+        runner.execute = execute
+        self.assertEqual(runner.update_and_plan_and_execute(self.goal), 'succeeded')
+        self.assertEqual(len(executed), 2)
+        self.assertTrue(executed[1].worldstate.matches(runner.worldstate))
+        self.assertIsNotNone(graphs[0])
+        self.assertIs(runner.planner._search_graph, graphs[0],
+                      'Failed repair should fall back to replanning incrementally')
+
+    def testNoDuplicateExpansions(self):
+        self.planner.plan()
+        # every reachable worldstate differs in the values of a and b only
+        self.assertLessEqual(self.planner.last_stats.expanded_nodes, 4 * 4)
+
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
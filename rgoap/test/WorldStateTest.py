@@ -0,0 +1,113 @@
+# Copyright (c) 2013, Felix Kolbe
+# All rights reserved. BSD License
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+# * Neither the name of the {organization} nor the names of its
+#   contributors may be used to endorse or promote products derived
+#   from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+
+from rgoap.common import Condition, WorldState
+
+
+class WorldStateTest(unittest.TestCase):
+
+    def setUp(self):
+        Condition._conditions_dict.clear() # start every test without previous conditions
+
+        self.condition1 = Condition('name1')
+        self.condition2 = Condition('name2')
+
+        self.worldstate = WorldState()
+        self.worldstate.set_condition_value(self.condition1, 1)
+        self.worldstate.set_condition_value(self.condition2, 'two')
+
+    def testCopyOnWrite(self):
+        copy = WorldState(self.worldstate)
+        self.assertIs(copy._values, self.worldstate._values,
+                      'Copy should share values until modified')
+        copy.set_condition_value(self.condition1, 1)
+        self.assertIs(copy._values, self.worldstate._values,
+                      'Setting an unchanged value should not copy')
+        copy.set_condition_value(self.condition1, 3)
+        self.assertEqual(copy.get_condition_value(self.condition1), 3)
+        self.assertEqual(self.worldstate.get_condition_value(self.condition1), 1,
+                         'Original should not be changed by its copy')
+
+    def testOriginalWrite(self):
+        copy = WorldState(self.worldstate)
+        self.worldstate.set_condition_value(self.condition2, 'three')
+        self.assertEqual(copy.get_condition_value(self.condition2), 'two',
+                         'Copy should not be changed by its original')
+
+    def testEqualityAndHash(self):
+        other = WorldState()
+        other.set_condition_value(self.condition2, 'two')
+        other.set_condition_value(self.condition1, 5)
+        self.assertNotEqual(other, self.worldstate)
+        other.set_condition_value(self.condition1, 1)
+        self.assertEqual(other, self.worldstate)
+        self.assertEqual(hash(other), hash(self.worldstate))
+
+        copy = WorldState(self.worldstate)
+        copy.set_condition_value(self.condition1, 2)
+        copy.set_condition_value(self.condition1, 1)
+        self.assertEqual(hash(copy), hash(self.worldstate))
+
+    def testUnset(self):
+        condition3 = Condition('name3')
+        self.assertRaises(KeyError, self.worldstate.get_condition_value, condition3)
+        other = WorldState()
+        other.set_condition_value(condition3, 3)
+        self.assertEqual(len(other), 1)
+        self.assertRaises(KeyError, other.get_condition_value, self.condition1)
+        self.assertNotEqual(other, self.worldstate)
+
+    def testComparisons(self):
+        condition3 = Condition('name3')
+        start = WorldState(self.worldstate)
+        start.set_condition_value(condition3, 3)
+        node = WorldState()
+        node.set_condition_value(self.condition2, 'two')
+        self.assertTrue(node.matches(start))
+        node.set_condition_value(condition3, 4)
+        self.assertFalse(node.matches(start))
+        self.assertEqual(node.get_unsatisfied_conditions(start), set([condition3]))
+        self.assertEqual(dict(node.iteritems()), {self.condition2: 'two', condition3: 4})
+
+    def testUnhashableValue(self):
+        copy = WorldState(self.worldstate)
+        copy.set_condition_value(self.condition1, [1, 2])
+        self.assertRaises(TypeError, hash, copy)
+        copy.set_condition_value(self.condition1, 1)
+        self.assertEqual(hash(copy), hash(self.worldstate))
+
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
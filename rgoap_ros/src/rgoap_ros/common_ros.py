@@ -49,7 +49,10 @@ _logger = logging.getLogger('rgoap.ros')
 class ROSTopicCondition(Condition):
     """Mirrors a ROS message field of a topic as its value.
     Note that this Condition's value remains None until a message is received.
+    Changes of the value are pushed to the observers.
     """
+    pushes_values = True
+
     def __init__(self, state_name, topic, topic_class, field=None, msgeval=None):
         Condition.__init__(self, state_name)
         self._topic = topic
@@ -66,12 +69,26 @@ class ROSTopicCondition(Condition):
         return '<%s topic=%s field=%s>' % (self.__class__.__name__, self._topic, self._field)
 
     def _callback(self, msg):
-        self._value = self._msgeval(msg)
+        value = self._msgeval(msg)
+        changed = self._differs(value, self._value)
+        self._value = value
+        if changed:
+            self.notify_observers()
 #        _logger.debug("callback with: %s", self._value)
 
     def get_value(self):
         return self._value
 
+    @staticmethod
+    def _differs(value, old_value):
+        """Return whether value differs from old_value, taking values that
+        do not compare to a plain bool, e.g. arrays, as changed"""
+        try:
+            differs = value != old_value
+        except Exception:
+            return True
+        return differs if type(differs) is bool else True
+
 
 class ROSTopicAction(Action):
 
@@ -112,15 +112,16 @@ class SMACHRunner(Runner):
             self._current_smach.service_preempt()
 
 
-    def plan(self, goal, introspection=False):
+    def plan(self, goal, introspection=False, budget=None):
         """plan for given goal and return start_node of plan or None
 
         introspection: introspect RGOAP planning via smach.introspection
+        budget: the PlanningBudget, see rgoap.Planner.plan()
         """
         if introspection:
             self._setup_introspection()
 
-        start_node = Runner.plan(self, goal, introspection)
+        start_node = Runner.plan(self, goal, introspection, budget)
 
         if introspection:
             if start_node is not None:
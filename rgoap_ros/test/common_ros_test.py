@@ -97,6 +97,22 @@ class Test(unittest.TestCase):
         self.assertFalse(self.rtc.get_value(), 'Now topic cond should have value False.')
 
 
+    def testRTC_array_value(self):
+        class Array(object):
+            """compares element-wise like a numpy array"""
+            def __ne__(self, other):
+                return self
+            def __nonzero__(self):
+                raise ValueError("The truth value of an array is ambiguous")
+        rtc = common_ros.ROSTopicCondition('topic.array', '/testarray', Bool,
+                                           msgeval=lambda msg: msg)
+        notified = []
+        rtc.add_observer(notified.append)
+        value = Array()
+        rtc._callback(value)
+        self.assertIs(rtc.get_value(), value)
+        self.assertEqual(notified, [rtc], 'Observers should be notified of array values')
+
     def testRTA_msg_args(self):
         print self.rta_true
         print self.rta_false
@@ -53,7 +53,7 @@ class RGOAPNodeWrapperState(State):
 #            print ' worldstate:', self.node.worldstate
 #            return 'aborted'
 #        print "Action %s valid to worldstate" % self.node.action
-        if not self.node.action.check_freeform_context():
+        if not self.node.action.is_freeform_context_valid():
             _logger.error("Action's freeform context isn't valid! Aborting"
                           " wrapping state for %s", self.node.action)
             return 'aborted'